@@ -5,25 +5,52 @@ Biedt web UI en REST API met basic authentication.
 """
 import os
 import re
+import hmac
+import hashlib
 import threading
-from functools import wraps
-from flask import Flask, request, jsonify, render_template_string, send_from_directory
-from werkzeug.security import check_password_hash, generate_password_hash
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+import sqlite3
+import orjson
+from flask import Flask, Response, request, jsonify, render_template_string, send_from_directory, stream_with_context
+from flask.json.provider import JSONProvider
 
 import database as db
 import calibreweb
 
+
+def _json_default(obj):
+    """Zet database rijen (sqlite3.Row) pas bij serialisatie om naar dict."""
+    if isinstance(obj, sqlite3.Row):
+        return dict(obj)
+    raise TypeError
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider op basis van orjson (sneller dan stdlib json)."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
 # Authenticatie configuratie
 USERNAME = os.environ.get('WEB_USERNAME', 'admin')
-PASSWORD_HASH = generate_password_hash(os.environ.get('WEB_PASSWORD', 'wishlist'))
+# Gedeeld wachtwoord uit env: een SHA-256 digest met constant-time vergelijking
+# volstaat en voorkomt een trage KDF berekening op elke request
+PASSWORD_SHA = hashlib.sha256(os.environ.get('WEB_PASSWORD', 'wishlist').encode()).digest()
 
 
 def check_auth(username: str, password: str) -> bool:
     """Controleer gebruikersnaam en wachtwoord."""
-    return username == USERNAME and check_password_hash(PASSWORD_HASH, password)
+    password_sha = hashlib.sha256((password or '').encode()).digest()
+    return username == USERNAME and hmac.compare_digest(password_sha, PASSWORD_SHA)
 
 
 def authenticate():
@@ -46,25 +73,38 @@ def requires_auth(f):
 
 # ===== WEB UI =====
 
+def _load_page(filename: str) -> tuple:
+    """Lees HTML pagina eenmalig in en bereken ETag."""
+    with open(os.path.join(app.root_path, 'static', filename), 'rb') as f:
+        content = f.read()
+    return content, hashlib.md5(content).hexdigest()
+
+
+# HTML pagina's wijzigen alleen bij een update (waarna herstart nodig is)
+_PAGES = {name: _load_page(name) for name in ('index.html', 'portal.html')}
+
+
+def _page_response(filename: str):
+    """Serveer HTML uit geheugen met ETag, zodat browsers 304 krijgen."""
+    content, etag = _PAGES[filename]
+    response = Response(content, mimetype='text/html')
+    response.set_etag(etag)
+    # Altijd revalideren, maar zonder de volledige pagina opnieuw te sturen
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
 @app.route('/')
 @requires_auth
 def index():
     """Hoofdpagina met web interface."""
-    response = send_from_directory('static', 'index.html')
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
-    return response
+    return _page_response('index.html')
 
 
 @app.route('/portal')
 def portal():
     """Portaal pagina met links naar alle apps (geen auth vereist)."""
-    response = send_from_directory('static', 'portal.html')
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
-    return response
+    return _page_response('portal.html')
 
 
 @app.route('/static/<path:path>')
@@ -78,29 +118,64 @@ def serve_static(path):
 
 # ===== API ENDPOINTS =====
 
+def _stream_json(key: str, rows, **extra) -> Response:
+    """
+    Stream {"<key>": [...rows], **extra} als JSON zonder de hele lijst
+    in geheugen op te bouwen.
+    """
+    def generate():
+        yield b'{"' + key.encode() + b'":['
+        first = True
+        for row in rows:
+            if not first:
+                yield b','
+            yield orjson.dumps(row, default=_json_default)
+            first = False
+        yield b']'
+        for name, value in extra.items():
+            yield b',"' + name.encode() + b'":' + orjson.dumps(value)
+        yield b'}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def _get_stats() -> dict:
+    """Tel items per status (inclusief totaal)."""
+    counts = db.get_status_counts()
+    stats = {'total': sum(counts.values())}
+    stats.update(counts)
+    return stats
+
+
 @app.route('/api/wishlist', methods=['GET'])
 @requires_auth
 def api_get_wishlist():
-    """Haal alle wishlist items op."""
+    """
+    Haal wishlist items op. Met ?stats=0 worden de tellingen overgeslagen.
+    Paginatie: ?limit=50, ?before=<id> en ?before_date=<added_date> van het
+    laatste item van de vorige pagina.
+    """
     status = request.args.get('status')
-    items = db.get_wishlist_items(status=status)
-
-    # Voeg count per status toe
-    all_items = db.get_wishlist_items()
-    stats = {
-        'total': len(all_items),
-        'pending': len([i for i in all_items if i['status'] == 'pending']),
-        'searching': len([i for i in all_items if i['status'] == 'searching']),
-        'found': len([i for i in all_items if i['status'] == 'found']),
-        'importing': len([i for i in all_items if i['status'] == 'importing']),
-        'shelved': len([i for i in all_items if i['status'] == 'shelved']),
-        'failed': len([i for i in all_items if i['status'] == 'failed']),
-    }
+    before_id = request.args.get('before', type=int)
+    before_date = request.args.get('before_date')
+    limit = request.args.get('limit', type=int)
 
-    return jsonify({
-        'items': items,
-        'stats': stats
-    })
+    # Cursor (added_date, id); zonder before_date opzoeken via het item zelf
+    before = None
+    if before_id is not None:
+        if before_date is None:
+            item = db.get_wishlist_item(before_id)
+            if not item:
+                return jsonify({'error': 'Item voor paginatie (before) bestaat niet meer; geef ook before_date mee'}), 400
+            before_date = item['added_date']
+        before = (before_date, before_id)
+
+    # Voeg count per status toe (tenzij de client ze niet nodig heeft)
+    include_stats = request.args.get('stats', '1') != '0'
+    stats = _get_stats() if include_stats else None
+
+    items = db.iter_wishlist_items(status=status, before=before, limit=limit)
+    return _stream_json('items', items, stats=stats)
 
 
 @app.route('/api/wishlist/<int:item_id>', methods=['GET'])
@@ -177,9 +252,8 @@ def api_bulk_delete_wishlist():
     status = data['status']
 
     # Valideer status
-    valid_statuses = ['pending', 'searching', 'found', 'importing', 'shelved', 'failed']
-    if status not in valid_statuses:
-        return jsonify({'error': f'Ongeldige status. Gebruik: {", ".join(valid_statuses)}'}), 400
+    if status not in db.STATUSES:
+        return jsonify({'error': f'Ongeldige status. Gebruik: {", ".join(db.STATUSES)}'}), 400
 
     try:
         deleted_count = db.bulk_delete_by_status(status)
@@ -200,6 +274,7 @@ def api_retry_search(item_id: int):
         return jsonify({'error': 'Item niet gevonden'}), 404
 
     db.update_wishlist_status(item_id, 'pending', error_message=None)
+    db.clear_spotweb_cache(item['author'], item['title'])
     db.add_log(item_id, 'info', 'Handmatig opnieuw zoeken gestart')
 
     return jsonify({'message': 'Zoekactie opnieuw gestart'}), 200
@@ -209,6 +284,9 @@ def api_retry_search(item_id: int):
 _search_lock = threading.Lock()
 _search_running = False
 
+# Aantal items dat parallel gezocht wordt (netwerk-bound)
+SEARCH_WORKERS = int(os.environ.get('SEARCH_WORKERS', '6'))
+
 
 def _run_search_now():
     """Draai zoekactie voor alle pending items in achtergrondthread."""
@@ -217,8 +295,9 @@ def _run_search_now():
         from worker import process_item
         pending = db.get_wishlist_items(status='pending')
         db.add_log(None, 'info', f'Handmatige zoekactie gestart voor {len(pending)} item(s)')
-        for item in pending:
-            process_item(item)
+        with ThreadPoolExecutor(max_workers=SEARCH_WORKERS) as ex:
+            # Handmatig: verse resultaten, niet uit de query caches van de worker
+            list(ex.map(partial(process_item, use_cache=False), pending))
     except Exception as e:
         db.add_log(None, 'error', f'Handmatige zoekactie fout: {e}')
     finally:
@@ -267,6 +346,10 @@ def api_update_status(item_id: int):
         error_message=data.get('error_message')
     )
 
+    # Handmatig terug naar pending: worker moet direct opnieuw zoeken
+    if data['status'] == 'pending':
+        db.clear_spotweb_cache(item['author'], item['title'])
+
     return jsonify({'message': 'Status bijgewerkt'}), 200
 
 
@@ -277,27 +360,15 @@ def api_get_logs():
     wishlist_id = request.args.get('wishlist_id', type=int)
     limit = request.args.get('limit', type=int, default=100)
 
-    logs = db.get_logs(wishlist_id=wishlist_id, limit=limit)
-    return jsonify({'logs': logs})
+    return _stream_json('logs', db.iter_logs(wishlist_id=wishlist_id, limit=limit))
 
 
 @app.route('/api/stats', methods=['GET'])
 @requires_auth
 def api_get_stats():
     """Haal statistieken op."""
-    items = db.get_wishlist_items()
-    logs = db.get_logs(limit=10)
-
-    stats = {
-        'total': len(items),
-        'pending': len([i for i in items if i['status'] == 'pending']),
-        'searching': len([i for i in items if i['status'] == 'searching']),
-        'found': len([i for i in items if i['status'] == 'found']),
-        'importing': len([i for i in items if i['status'] == 'importing']),
-        'shelved': len([i for i in items if i['status'] == 'shelved']),
-        'failed': len([i for i in items if i['status'] == 'failed']),
-        'recent_logs': logs
-    }
+    stats = _get_stats()
+    stats['recent_logs'] = db.get_logs(limit=10)
 
     return jsonify(stats)
 
@@ -353,11 +424,58 @@ def api_health():
     })
 
 
+# Achtergrond git pull jobs: job_id -> status record. Afgeronde jobs
+# verdwijnen na het uitlezen; nooit meer dan MAX_UPDATE_JOBS (oudste eruit)
+_update_jobs = {}
+_update_lock = threading.Lock()
+MAX_UPDATE_JOBS = 20
+
+
+def _do_git_pull(job_id: str) -> None:
+    """Voer git pull uit in achtergrondthread en sla resultaat op in de job."""
+    import subprocess
+
+    try:
+        result = subprocess.run(
+            ['git', 'pull', 'origin', 'claude/wishlist-web-interface-80kID'],
+            cwd='/app',
+            capture_output=True,
+            text=True,
+            timeout=30
+        )
+
+        if result.returncode == 0:
+            db.add_log(None, 'info', f'Code update: {result.stdout.strip()}')
+            job = {
+                'status': 'done',
+                'message': 'Update succesvol',
+                'output': result.stdout,
+                'restart_required': True
+            }
+        else:
+            job = {
+                'status': 'failed',
+                'error': 'Git pull mislukt',
+                'output': result.stderr
+            }
+
+    except subprocess.TimeoutExpired:
+        job = {'status': 'failed', 'error': 'Git pull timeout'}
+    except Exception as e:
+        job = {'status': 'failed', 'error': str(e)}
+
+    with _update_lock:
+        # Job kan intussen weggevallen zijn (limiet); dan niet opnieuw toevoegen
+        if job_id in _update_jobs:
+            _update_jobs[job_id] = job
+
+
 @app.route('/api/update', methods=['POST'])
 @requires_auth
 def api_update():
-    """Update applicatie code via git pull."""
+    """Start update van applicatie code via git pull (op de achtergrond)."""
     import subprocess
+    import uuid
 
     try:
         # Check of we in een git repository zitten
@@ -375,38 +493,57 @@ def api_update():
                 'hint': 'Code is waarschijnlijk handmatig geüpload'
             }), 400
 
-        # Git pull uitvoeren
-        result = subprocess.run(
-            ['git', 'pull', 'origin', 'claude/wishlist-web-interface-80kID'],
-            cwd='/app',
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-
-        if result.returncode == 0:
-            db.add_log(None, 'info', f'Code update: {result.stdout.strip()}')
-            return jsonify({
-                'message': 'Update succesvol',
-                'output': result.stdout,
-                'restart_required': True
-            }), 200
-        else:
-            return jsonify({
-                'error': 'Git pull mislukt',
-                'output': result.stderr
-            }), 500
-
     except subprocess.TimeoutExpired:
-        return jsonify({'error': 'Git pull timeout'}), 500
+        return jsonify({'error': 'Git timeout'}), 500
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+    # Git pull uitvoeren zonder de request thread te blokkeren
+    job_id = uuid.uuid4().hex
+    with _update_lock:
+        # Nooit twee git pulls tegelijk in dezelfde werkmap
+        if any(job['status'] == 'running' for job in _update_jobs.values()):
+            return jsonify({'error': 'Er draait al een update'}), 409
+
+        while len(_update_jobs) >= MAX_UPDATE_JOBS:
+            del _update_jobs[next(iter(_update_jobs))]
+        _update_jobs[job_id] = {'status': 'running'}
+
+    thread = threading.Thread(target=_do_git_pull, args=(job_id,), daemon=True)
+    thread.start()
+
+    return jsonify({
+        'message': 'Update gestart',
+        'job_id': job_id
+    }), 202
+
+
+@app.route('/api/update/status/<job_id>', methods=['GET'])
+@requires_auth
+def api_update_job_status(job_id: str):
+    """Haal status op van een update job (afgeronde jobs maar één keer)."""
+    with _update_lock:
+        job = _update_jobs.get(job_id)
+        if job is not None and job['status'] != 'running':
+            del _update_jobs[job_id]
+
+    if job is None:
+        return jsonify({'error': 'Update job niet gevonden'}), 404
+
+    return jsonify(dict(job, job_id=job_id))
+
 
 # ===== STARTUP =====
 
+_initialized = False
+
+
 def initialize():
-    """Initialiseer applicatie bij startup."""
+    """Initialiseer applicatie bij startup (idempotent)."""
+    global _initialized
+    if _initialized:
+        return
+
     # Initialiseer database
     db.init_db()
 
@@ -414,16 +551,20 @@ def initialize():
     txt_path = os.environ.get("WISHLIST_FILE", "/data/wishlist.txt")
     if os.path.exists(txt_path):
         db.migrate_from_txt(txt_path)
-        # Backup maken en verwijderen
-        import shutil
+        # Origineel hernoemen naar backup (atomair, geen kopie nodig)
         backup_path = txt_path + ".backup"
-        shutil.copy(txt_path, backup_path)
-        os.remove(txt_path)
+        os.replace(txt_path, backup_path)
         print(f"✓ Wishlist.txt gemigreerd en backup gemaakt: {backup_path}")
 
+    _initialized = True
+
+
+# Ook initialiseren bij import, zodat een WSGI server (gunicorn e.d.) de
+# database klaarzet zonder via __main__ te starten
+initialize()
+
 
 if __name__ == '__main__':
-    initialize()
 
     # Start Flask server
     host = os.environ.get('FLASK_HOST', '0.0.0.0')
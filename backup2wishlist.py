@@ -2,9 +2,11 @@
 import os
 import time
 import re
-import requests
-from urllib.parse import urlencode
-from lxml import etree
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+
+from matching import query_key
+from spotweb import ENCLOSURE_URL, HTTP_TIMEOUT, iter_spotweb_items, make_session
 
 # ====== CONFIG via environment ======
 SPOTWEB_BASE_URL = os.environ["SPOTWEB_BASE_URL"].rstrip("/")
@@ -16,6 +18,15 @@ WISHLIST_FILE    = os.environ.get("WISHLIST_FILE", "/data/wishlist.txt")
 INTERVAL_SECONDS = int(os.environ.get("INTERVAL_SECONDS", "900"))
 SPOTWEB_CAT      = os.environ.get("SPOTWEB_CAT", "7020")   # Ebook
 SAB_CATEGORY     = os.environ.get("SAB_CATEGORY", "books")
+MAX_WORKERS      = int(os.environ.get("MAX_WORKERS", "8"))
+VARIANT_WORKERS  = int(os.environ.get("VARIANT_WORKERS", "4"))
+
+# Gecompileerde patronen voor search_variants
+_WORD_RE = re.compile(r"[A-Za-zÀ-ÿ0-9]+")
+_DASH_TABLE = str.maketrans("–—", "--")
+
+# Gedeelde HTTP sessie (pool groot genoeg voor alle regels x varianten tegelijk)
+_SESSION = make_session(MAX_WORKERS * VARIANT_WORKERS, "backup2wishlist/1.0")
 
 
 def read_wishlist(path: str) -> list[str]:
@@ -45,7 +56,7 @@ def search_variants(text: str) -> list[str]:
     t = text.strip()
 
     # Normaliseer streepjes
-    t_norm = t.replace("–", "-").replace("—", "-")
+    t_norm = t.translate(_DASH_TABLE)
     variants.append(t)
     if t_norm != t:
         variants.append(t_norm)
@@ -62,56 +73,68 @@ def search_variants(text: str) -> list[str]:
         ])
 
     # Alleen woorden (geen leestekens)
-    words = re.findall(r"[A-Za-zÀ-ÿ0-9]+", t_norm, flags=re.UNICODE)
+    words = _WORD_RE.findall(t_norm)
     if words:
         variants.append(" ".join(words))      # alles als woorden
         variants.append(words[-1])            # laatste woord (bv "camino")
     if len(words) >= 3:
         variants.append(" ".join(words[-3:])) # laatste 3 woorden
 
-    # Uniek houden
-    seen = set()
-    out: list[str] = []
+    # Uniek houden op genormaliseerde woorden (eerste variant wint)
+    unique: dict[tuple, str] = {}
     for v in variants:
-        v = v.strip()
-        key = v.lower()
-        if v and key not in seen:
-            out.append(v)
-            seen.add(key)
+        key = query_key(v)
+        if key:
+            unique.setdefault(key, v.strip())
+
+    return list(unique.values())
 
-    return out
+
+def _spotweb_query_first_url(q: str) -> str | None:
+    """Eén Spotweb zoekopdracht; return eerste enclosure URL of None."""
+    params = {
+        "apikey": SPOTWEB_APIKEY,
+        "t": "search",
+        "extended": "1",
+        "q": q,
+        "cat": SPOTWEB_CAT,
+        "limit": "25",
+    }
+    with _SESSION.get(f"{SPOTWEB_BASE_URL}/api", params=params, timeout=HTTP_TIMEOUT, stream=True) as r:
+        r.raise_for_status()
+
+        for item in iter_spotweb_items(r):
+            enc_url = ENCLOSURE_URL(item)
+            if enc_url:
+                return enc_url
+
+    return None
 
 
 def spotweb_search_first_nzb_url(query: str) -> str | None:
     """
     Vraagt Spotweb Newznab API om resultaten en pakt de eerste enclosure URL (NZB).
     Tolerant XML parsen via lxml (recover=True), omdat Spotweb XML soms niet strikt valide is.
-    """
-    parser = etree.XMLParser(recover=True)
-
-    for q in search_variants(query):
-        params = {
-            "apikey": SPOTWEB_APIKEY,
-            "t": "search",
-            "extended": "1",
-            "q": q,
-            "cat": SPOTWEB_CAT,
-            "limit": "25",
-        }
-        url = f"{SPOTWEB_BASE_URL}/api?{urlencode(params)}"
-        r = requests.get(url, timeout=30)
-        r.raise_for_status()
+    De response wordt gestreamd en het parsen stopt bij de eerste bruikbare enclosure.
 
-        root = etree.fromstring(r.content, parser)
-        channel = root.find("channel")
-        if channel is None:
-            continue
-
-        for item in channel.findall("item"):
-            enc = item.find("enclosure")
-            if enc is not None and "url" in enc.attrib:
+    Alle zoekvarianten worden parallel opgevraagd; de volgorde van de
+    varianten bepaalt nog steeds welke match wint.
+    """
+    variants = search_variants(query)
+    if not variants:
+        return None
+
+    ex = ThreadPoolExecutor(max_workers=min(len(variants), VARIANT_WORKERS))
+    try:
+        futures = [ex.submit(_spotweb_query_first_url, q) for q in variants]
+        for q, future in zip(variants, futures):
+            nzb_url = future.result()
+            if nzb_url:
                 print(f"Match gevonden via zoekterm: {q}")
-                return enc.attrib["url"]
+                return nzb_url
+    finally:
+        # Niet wachten op overbodige varianten
+        ex.shutdown(wait=False, cancel_futures=True)
 
     return None
 
@@ -130,14 +153,38 @@ def sab_addurl(nzb_url: str, nzbname: str) -> bool:
     if SAB_CATEGORY:
         params["cat"] = SAB_CATEGORY
 
-    url = f"{SAB_BASE_URL}/api?{urlencode(params)}"
-    r = requests.get(url, timeout=30)
+    r = _SESSION.get(f"{SAB_BASE_URL}/api", params=params, timeout=HTTP_TIMEOUT)
     r.raise_for_status()
 
-    data = r.json()
+    data = orjson.loads(r.content)
     return bool(data.get("status")) or bool(data.get("nzo_ids"))
 
 
+def process_book(book: str) -> bool:
+    """
+    Zoek een boek in Spotweb en voeg het toe aan SAB.
+    Returns True als het boek van de wishlist af mag.
+    """
+    try:
+        nzb_url = spotweb_search_first_nzb_url(book)
+
+        if not nzb_url:
+            print(f"Niet gevonden: {book}")
+            return False
+
+        ok = sab_addurl(nzb_url, nzbname=book)
+        if ok:
+            print(f"Toegevoegd aan SAB: {book}")
+            # SAB regelt download + mail (zoals jij hebt ingesteld)
+        else:
+            print(f"SAB kon niet toevoegen: {book}")
+        return ok
+
+    except Exception as e:
+        print(f"Fout bij '{book}': {e}")
+        return False
+
+
 def main() -> None:
     print("Wishlist container gestart (Spotweb -> SABnzbd)")
 
@@ -149,28 +196,11 @@ def main() -> None:
             time.sleep(INTERVAL_SECONDS)
             continue
 
-        remaining: list[str] = []
-
-        for book in wishlist:
-            try:
-                nzb_url = spotweb_search_first_nzb_url(book)
-
-                if not nzb_url:
-                    print(f"Niet gevonden: {book}")
-                    remaining.append(book)
-                    continue
-
-                ok = sab_addurl(nzb_url, nzbname=book)
-                if ok:
-                    print(f"Toegevoegd aan SAB: {book}")
-                    # SAB regelt download + mail (zoals jij hebt ingesteld)
-                else:
-                    print(f"SAB kon niet toevoegen: {book}")
-                    remaining.append(book)
+        # Boeken parallel verwerken (I/O-bound); map behoudt de volgorde
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+            done = list(ex.map(process_book, wishlist))
 
-            except Exception as e:
-                print(f"Fout bij '{book}': {e}")
-                remaining.append(book)
+        remaining = [book for book, ok in zip(wishlist, done) if not ok]
 
         if remaining != wishlist:
             write_wishlist(WISHLIST_FILE, remaining)
@@ -5,34 +5,142 @@ Haalt boekenplanken op via de Calibre-Web web interface.
 """
 import os
 import re
+import logging
+import time
+import functools
+import threading
 import unicodedata
+from collections import OrderedDict
 import requests
-from typing import List, Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from io import BytesIO
+from lxml import etree
+from typing import List, Dict, Optional, Iterator, Iterable
+
+log = logging.getLogger(__name__)
 
 CALIBREWEB_URL = os.environ.get("CALIBREWEB_URL", "").rstrip("/")
 CALIBREWEB_USERNAME = os.environ.get("CALIBREWEB_USERNAME", "")
 CALIBREWEB_PASSWORD = os.environ.get("CALIBREWEB_PASSWORD", "")
 
+# Environment wordt alleen bij import gelezen
+_CONFIGURED = bool(CALIBREWEB_URL and CALIBREWEB_USERNAME and CALIBREWEB_PASSWORD)
+_SHELF_ADD_URL = CALIBREWEB_URL + "/shelf/add/{shelf_id}/{book_id}"
+
+# Atom tags in Clark notatie (geen XPath/namespace-map nodig)
+_ATOM = "{http://www.w3.org/2005/Atom}"
+_ATOM_ENTRY = _ATOM + "entry"
+_ATOM_TITLE = _ATOM + "title"
+_ATOM_AUTHOR = _ATOM + "author"
+_ATOM_NAME = _ATOM + "name"
+_ATOM_LINK = _ATOM + "link"
+
+# Voorgecompileerde patronen
+# csrf_token input, met name vóór of na value: één scan over de pagina.
+# Bytes patroon: de response hoeft niet eerst gedecodeerd te worden.
+_CSRF_RE = re.compile(
+    rb'name=["\']csrf_token["\'][^>]*value=["\']([^"\']+)["\']'
+    rb'|value=["\']([^"\']+)["\'][^>]*name=["\']csrf_token["\']'
+)
+_MATCH_WORD_RE = re.compile(r'\S{3,}')
+_SHELF_HREF_RE = re.compile(r'/shelf/(\d+)$')
+_BOOK_ID_RE = re.compile(r'/(?:opds/(?:cover|download)|book)/(\d+)', re.ASCII)
+
+# Veelvoorkomende Latin-1 accenten direct naar ASCII (zelfde uitkomst als NFD)
+_ACCENT_MAP = str.maketrans(
+    "àáâãäåçèéêëìíîïñòóôõöùúûüýÿ",
+    "aaaaaaceeeeiiiinooooouuuuyy",
+)
+
 # Cache voor sessie en planken
 _session: Optional[requests.Session] = None
+_opds_session: Optional[requests.Session] = None
 _shelves_cache: Optional[List[Dict]] = None
 _cache_time: float = 0
-CACHE_TTL = 300  # 5 minuten
+_shelves_etag: Optional[str] = None
+_shelves_last_mod: Optional[str] = None
+CACHE_TTL = 300  # 5 minuten: daarna ververst op de achtergrond
+CACHE_HARD_TTL = 600  # 10 minuten: daarna synchroon verversen
+
+# Locks voor gedeelde state (meerdere request threads + achtergrond refresh)
+_session_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_book_cache_lock = threading.Lock()
+
+# Opzoek-index op de planken-cache (zie _build_shelf_index)
+_shelf_by_name: Dict[str, int] = {}
+_shelf_by_lower: Dict[str, int] = {}
+_shelf_lower: List[tuple] = []
+
+# LRU cache voor gevonden boeken: (auteur, titel) -> (tijdstip, book_id)
+_book_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+BOOK_CACHE_SIZE = 1024
+BOOK_NOT_FOUND_TTL = 60  # niet-gevonden kort cachen: net geïmporteerd boek snel zichtbaar
+
+# CSRF token per sessie hergebruiken: (token, tijdstip)
+_csrf_cache: Optional[tuple] = None
+_CSRF_TTL = 300  # 5 minuten
 
 
 def is_configured() -> bool:
     """Check of Calibre-Web integratie geconfigureerd is."""
-    return bool(CALIBREWEB_URL and CALIBREWEB_USERNAME and CALIBREWEB_PASSWORD)
+    return _CONFIGURED
+
+
+def _mount_pool(session: requests.Session) -> None:
+    """
+    Zet connection pooling (keep-alive) op voor een sessie, met retries op
+    tijdelijke gateway fouten zodat de sessie (cookies) behouden blijft.
+    Alleen GET/HEAD: een POST (login, plank toevoegen) wordt nooit herhaald.
+    Na de laatste poging komt de response gewoon terug (geen RetryError),
+    zodat de status_code checks van de aanroeper blijven werken.
+    """
+    retry = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+
+def _get_opds_session() -> requests.Session:
+    """Sessie voor OPDS requests met Basic Auth (hergebruikt verbindingen)."""
+    global _opds_session
+
+    if _opds_session is not None:
+        return _opds_session
+
+    with _session_lock:
+        if _opds_session is None:
+            session = requests.Session()
+            _mount_pool(session)
+            session.auth = (CALIBREWEB_USERNAME, CALIBREWEB_PASSWORD)
+            _opds_session = session
+        return _opds_session
 
 
 def _get_session() -> requests.Session:
     """Login bij Calibre-Web en return sessie met cookies."""
-    global _session
-
     if _session is not None:
         return _session
 
+    with _session_lock:
+        if _session is not None:
+            return _session
+        return _login()
+
+
+def _login() -> requests.Session:
+    """Log in bij Calibre-Web (aanroeper houdt _session_lock vast)."""
+    global _session
+
     session = requests.Session()
+    _mount_pool(session)
     login_url = f"{CALIBREWEB_URL}/login"
 
     try:
@@ -41,10 +149,7 @@ def _get_session() -> requests.Session:
         resp.raise_for_status()
 
         # Extract CSRF token uit login formulier
-        csrf_match = re.search(
-            r'name=["\']csrf_token["\'][^>]*value=["\']([^"\']+)["\']',
-            resp.text
-        )
+        csrf_match = _CSRF_RE.search(resp.content)
 
         # Login POST
         login_data = {
@@ -56,13 +161,13 @@ def _get_session() -> requests.Session:
         }
 
         if csrf_match:
-            login_data["csrf_token"] = csrf_match.group(1)
+            login_data["csrf_token"] = (csrf_match.group(1) or csrf_match.group(2)).decode("ascii", "replace")
 
         resp = session.post(login_url, data=login_data, timeout=10, allow_redirects=True)
         resp.raise_for_status()
 
         # Check of login gelukt is (redirect naar / of bevat geen login form)
-        if "/login" in resp.url and "login" in resp.text.lower():
+        if "/login" in resp.url and b"login" in resp.content.lower():
             raise ConnectionError("Calibre-Web login mislukt - controleer credentials")
 
         _session = session
@@ -74,8 +179,10 @@ def _get_session() -> requests.Session:
 
 def _invalidate_session():
     """Reset sessie zodat opnieuw ingelogd wordt."""
-    global _session
-    _session = None
+    global _session, _csrf_cache
+    with _session_lock:
+        _session = None
+        _csrf_cache = None
 
 
 def fetch_shelves() -> List[Dict]:
@@ -84,127 +191,266 @@ def fetch_shelves() -> List[Dict]:
 
     Returns: Lijst van dicts met 'id', 'name', 'count'
     """
-    import time
-    global _shelves_cache, _cache_time
+    # Lokale kopie: clear_cache kan de globals tussendoor resetten
+    shelves, cache_time = _shelves_cache, _cache_time
+    if shelves is not None:
+        age = time.time() - cache_time
 
-    # Return cache als nog geldig
-    if _shelves_cache is not None and (time.time() - _cache_time) < CACHE_TTL:
-        return _shelves_cache
+        # Return cache als nog geldig
+        if age < CACHE_TTL:
+            return shelves
+
+        # Verouderd maar bruikbaar: ververs op de achtergrond (stale-while-revalidate)
+        if age < CACHE_HARD_TTL:
+            if _refresh_lock.acquire(blocking=False):
+                threading.Thread(target=_refresh_shelves_background, daemon=True).start()
+            return shelves
 
     if not is_configured():
         return []
 
+    with _refresh_lock:
+        # Een andere thread kan de cache net ververst hebben
+        shelves, cache_time = _shelves_cache, _cache_time
+        if shelves is not None and (time.time() - cache_time) < CACHE_TTL:
+            return shelves
+        return _refresh_shelves()
+
+
+def _refresh_shelves_background() -> None:
+    """Ververs de planken-cache in een achtergrond thread (houdt _refresh_lock vast)."""
+    try:
+        _refresh_shelves()
+    except Exception as e:
+        log.warning("[CALIBREWEB] Planken verversen mislukt: %s", e)
+    finally:
+        _refresh_lock.release()
+
+
+def _refresh_shelves() -> List[Dict]:
+    """Haal de planken opnieuw op en vul de cache (aanroeper houdt _refresh_lock vast)."""
+    global _shelves_cache, _cache_time, _shelves_etag, _shelves_last_mod
+
+    # Revalideer verlopen cache met conditional GET
+    cached = _shelves_cache
+    headers = {}
+    if cached is not None:
+        if _shelves_etag:
+            headers["If-None-Match"] = _shelves_etag
+        if _shelves_last_mod:
+            headers["If-Modified-Since"] = _shelves_last_mod
+
+    # Response wordt gestreamd: parsen stopt zodra de planken binnen zijn
     try:
         session = _get_session()
-        resp = session.get(f"{CALIBREWEB_URL}/", timeout=10)
+        resp = session.get(f"{CALIBREWEB_URL}/", headers=headers, timeout=10, stream=True)
         resp.raise_for_status()
     except ConnectionError:
         _invalidate_session()
         # Probeer opnieuw met verse sessie
         session = _get_session()
-        resp = session.get(f"{CALIBREWEB_URL}/", timeout=10)
+        resp = session.get(f"{CALIBREWEB_URL}/", headers=headers, timeout=10, stream=True)
         resp.raise_for_status()
 
-    shelves = _parse_shelves(resp.text)
+    with resp:
+        if resp.status_code == 304 and cached is not None:
+            _cache_time = time.time()
+            return cached
+
+        shelves = _parse_shelves(resp.iter_content(chunk_size=16384), resp.encoding or "utf-8")
 
     _shelves_cache = shelves
     _cache_time = time.time()
+    _build_shelf_index(shelves)
+    _shelves_etag = resp.headers.get("ETag")
+    _shelves_last_mod = resp.headers.get("Last-Modified")
 
     return shelves
 
 
-def _parse_shelves(html: str) -> List[Dict]:
-    """
-    Parse boekenplanken uit Calibre-Web sidebar HTML.
+def _shelf_from_link(link) -> Optional[Dict]:
+    """Maak shelf dict van een <a href=".../shelf/<id>"> element (of None)."""
+    id_match = _SHELF_HREF_RE.search(link.get("href", ""))
+    if not id_match:
+        return None
 
-    Zoekt naar links met /shelf/<id> patroon in de navigatie.
-    """
-    shelves = []
+    # Extract count uit badge span en haal die uit de naam
+    count = 0
+    for badge in link.iterdescendants():
+        if "badge" not in (badge.get("class") or ""):
+            continue
+        badge_text = "".join(badge.itertext()).strip()
+        if badge_text.isdigit():
+            count = int(badge_text)
+            # Verwijder badge maar behoud tekst erachter (tail)
+            parent, previous = badge.getparent(), badge.getprevious()
+            if badge.tail:
+                if previous is not None:
+                    previous.tail = (previous.tail or "") + badge.tail
+                else:
+                    parent.text = (parent.text or "") + badge.tail
+            parent.remove(badge)
+            break
 
-    # Zoek alle shelf links: <a href="/shelf/123">...Naam (Openbaar)...<span class="badge">5</span></a>
-    link_pattern = r'href="[^"]*?/shelf/(\d+)"[^>]*>(.*?)</a>'
-    for match in re.finditer(link_pattern, html, re.DOTALL):
-        shelf_id = match.group(1)
-        inner = match.group(2)
+    name = " ".join("".join(link.itertext()).split())
+    if not name:
+        return None
 
-        # Verwijder HTML tags om de naam te krijgen
-        name = re.sub(r'<[^>]+>', ' ', inner).strip()
-        name = re.sub(r'\s+', ' ', name).strip()
+    return {
+        "id": int(id_match.group(1)),
+        "name": name,
+        "count": count,
+    }
 
-        if not name:
-            continue
 
-        # Extract count uit badge span
-        count_match = re.search(r'class="[^"]*badge[^"]*"[^>]*>\s*(\d+)\s*<', inner)
-        count = int(count_match.group(1)) if count_match else 0
+def _parse_shelves(chunks: Iterable[bytes], encoding: str = "utf-8") -> List[Dict]:
+    """
+    Parse boekenplanken incrementeel uit Calibre-Web sidebar HTML.
 
-        # Verwijder count uit naam als het erin zit
-        if count:
-            name = re.sub(r'\s*\d+\s*$', '', name).strip()
+    Zoekt naar links met /shelf/<id> patroon in de navigatie en stopt zodra
+    de <nav> met planken gesloten is (rest van de pagina is niet nodig).
+    """
+    by_id: Dict[int, Dict] = {}
+    parser = etree.HTMLPullParser(events=("end",), tag=("a", "nav"), encoding=encoding)
+
+    def handle_events() -> bool:
+        """Verwerk events; True als de navigatie met planken klaar is."""
+        for _, el in parser.read_events():
+            if el.tag == "nav":
+                if by_id:
+                    return True
+                continue
+
+            # Duplicaten overslaan (eerste link per plank wint)
+            shelf = _shelf_from_link(el)
+            if shelf is not None and shelf["id"] not in by_id:
+                by_id[shelf["id"]] = shelf
+        return False
 
-        shelves.append({
-            "id": int(shelf_id),
-            "name": name,
-            "count": count,
-        })
+    # Alle shelf links: <a href="/shelf/123">...Naam (Openbaar)...<span class="badge">5</span></a>
+    for chunk in chunks:
+        parser.feed(chunk)
+        if handle_events():
+            return list(by_id.values())
 
-    # Verwijder duplicaten
-    seen = set()
-    unique = []
-    for s in shelves:
-        if s["id"] not in seen:
-            seen.add(s["id"])
-            unique.append(s)
+    try:
+        parser.close()
+    except etree.ParseError:
+        pass
+    handle_events()
 
-    return unique
+    return list(by_id.values())
 
 
 def clear_cache():
-    """Wis de planken-cache."""
-    global _shelves_cache, _cache_time
-    _shelves_cache = None
-    _cache_time = 0
+    """Wis de planken-cache en de boeken-cache."""
+    global _shelves_cache, _cache_time, _shelves_etag, _shelves_last_mod
+    # Zelfde lock als _refresh_shelves: wacht op een lopende refresh
+    with _refresh_lock:
+        _shelves_cache = None
+        _cache_time = 0
+        _shelves_etag = None
+        _shelves_last_mod = None
+        _build_shelf_index([])
+    with _book_cache_lock:
+        _book_cache.clear()
+
+
+def _build_shelf_index(shelves: List[Dict]) -> None:
+    """Bouw opzoek-index voor _get_shelf_id (eenmalig per cache refresh)."""
+    global _shelf_by_name, _shelf_by_lower, _shelf_lower
+
+    by_name: Dict[str, int] = {}
+    by_lower: Dict[str, int] = {}
+    lower: List[tuple] = []
+    for shelf in shelves:
+        name_lower = shelf["name"].lower()
+        by_name.setdefault(shelf["name"], shelf["id"])
+        by_lower.setdefault(name_lower, shelf["id"])
+        # (id, naam in kleine letters, woordenset)
+        lower.append((shelf["id"], name_lower, frozenset(name_lower.split())))
+
+    _shelf_by_name = by_name
+    _shelf_by_lower = by_lower
+    _shelf_lower = lower
 
 
 def _get_shelf_id(shelf_name: str) -> Optional[int]:
     """Zoek shelf_id op basis van naam. Ondersteunt fuzzy matching."""
-    shelves = fetch_shelves()
+    fetch_shelves()
+    return _lookup_shelf_id(shelf_name)
+
+
+def resolve_shelf_ids(shelf_names: Iterable[str]) -> Dict[str, Optional[int]]:
+    """
+    Zoek shelf_ids voor meerdere namen in één keer (één fetch_shelves).
 
+    Returns: dict van naam → shelf_id (None als niet gevonden)
+    """
+    fetch_shelves()
+    return {name: _lookup_shelf_id(name) for name in set(shelf_names)}
+
+
+def _lookup_shelf_id(shelf_name: str) -> Optional[int]:
+    """Zoek shelf_id in de index van de planken-cache."""
     # Exacte match eerst
-    for shelf in shelves:
-        if shelf["name"] == shelf_name:
-            return shelf["id"]
+    shelf_id = _shelf_by_name.get(shelf_name)
+    if shelf_id is not None:
+        return shelf_id
 
-    # Fuzzy match: case-insensitive, "Kobo GJ" matcht "Kobo GJ (Openbaar)"
+    # Exacte match zonder hoofdletters
     shelf_lower = shelf_name.lower().strip()
-    for shelf in shelves:
-        if shelf["name"].lower().startswith(shelf_lower):
-            return shelf["id"]
+    shelf_id = _shelf_by_lower.get(shelf_lower)
+    if shelf_id is not None:
+        return shelf_id
 
-    # Nog losser: check of alle woorden voorkomen
+    # Fuzzy match: case-insensitive, "Kobo GJ" matcht "Kobo GJ (Openbaar)"
+    for shelf_id, name_lower, _ in _shelf_lower:
+        if name_lower.startswith(shelf_lower):
+            return shelf_id
+
+    # Nog losser: check of alle woorden voorkomen (hele woorden via set)
     shelf_words = shelf_lower.split()
-    for shelf in shelves:
-        name_lower = shelf["name"].lower()
+    word_set = frozenset(shelf_words)
+    for shelf_id, _, name_words in _shelf_lower:
+        if word_set <= name_words:
+            return shelf_id
+
+    # Als laatste: woorden als deel van een woord ("openb" in "(openbaar)")
+    for shelf_id, name_lower, _ in _shelf_lower:
         if all(w in name_lower for w in shelf_words):
-            return shelf["id"]
+            return shelf_id
 
     return None
 
 
-def _opds_search(query: str) -> Optional[list]:
+def _iter_opds_entries(content: bytes) -> Iterator:
     """
-    Voer een OPDS zoekopdracht uit en return entries of None.
-    Gebruikt Basic Auth (OPDS accepteert geen session cookies).
+    Parse OPDS entries incrementeel; elk entry wordt na gebruik opgeruimd
+    zodat niet de hele feed als boom in geheugen blijft.
     """
-    from lxml import etree
+    context = etree.iterparse(BytesIO(content), events=("end",), tag=(_ATOM_ENTRY, "entry"))
+    try:
+        for _, entry in context:
+            yield entry
+            entry.clear()
+            while entry.getprevious() is not None:
+                del entry.getparent()[0]
+    except etree.XMLSyntaxError:
+        return
 
+
+def _opds_search(query: str) -> Optional[Iterator]:
+    """
+    Voer een OPDS zoekopdracht uit en return een iterator over entries of None.
+    Gebruikt Basic Auth (OPDS accepteert geen session cookies).
+    """
     opds_url = f"{CALIBREWEB_URL}/opds/search"
 
     try:
-        resp = requests.get(
+        resp = _get_opds_session().get(
             opds_url,
             params={"query": query},
-            auth=(CALIBREWEB_USERNAME, CALIBREWEB_PASSWORD),
             timeout=15,
         )
         resp.raise_for_status()
@@ -215,88 +461,135 @@ def _opds_search(query: str) -> Optional[list]:
     if "html" in content_type:
         return None
 
-    try:
-        root = etree.fromstring(resp.content)
-    except Exception:
-        return None
-
-    ns = {"atom": "http://www.w3.org/2005/Atom"}
-    entries = root.findall("atom:entry", ns)
-    if not entries:
-        entries = root.findall("entry")
-
-    return entries if entries else None
+    return _iter_opds_entries(resp.content)
 
 
+@functools.lru_cache(maxsize=4096)
 def _normalize(text: str) -> str:
     """Strip accenten voor vergelijking (björg → bjorg, aegisdóttir → aegisdottir)."""
-    text = unicodedata.normalize("NFD", text.lower())
+    text = text.lower()
+    if text.isascii():
+        return text
+    text = text.translate(_ACCENT_MAP)
+    if text.isascii():
+        return text
+    text = unicodedata.normalize("NFD", text)
     return "".join(c for c in text if unicodedata.category(c) != "Mn")
 
 
+@functools.lru_cache(maxsize=1024)
+def _match_parts(text: str) -> tuple:
+    """Genormaliseerde woorden (> 2 tekens) om entries op te matchen."""
+    return tuple(_MATCH_WORD_RE.findall(_normalize(text)))
+
+
 def search_book(author: str, title: str) -> Optional[int]:
     """
     Zoek een boek in Calibre-Web via de OPDS feed.
     Probeert meerdere zoekstrategieën: titel, auteur+titel, auteur.
 
+    Gevonden book_ids worden CACHE_TTL seconden gecachet, niet-gevonden
+    resultaten BOOK_NOT_FOUND_TTL seconden (een net geïmporteerd boek
+    wordt dus binnen een minuut gevonden).
+
     Returns: book_id als gevonden, anders None
     """
     if not is_configured():
         return None
 
-    # Probeer meerdere queries - Calibre-Web OPDS zoekt soms alleen op één veld
-    queries = [title, f"{author} {title}", author]
-    seen = set()
-    unique_queries = []
-    for q in queries:
-        q = q.strip()
-        if q and q not in seen:
-            seen.add(q)
-            unique_queries.append(q)
-
-    entries = None
-    for query in unique_queries:
-        entries = _opds_search(query)
-        if entries:
-            break
+    key = (author.lower().strip(), title.lower().strip())
+    with _book_cache_lock:
+        cached = _book_cache.get(key)
+        if cached is not None:
+            ttl = CACHE_TTL if cached[1] is not None else BOOK_NOT_FOUND_TTL
+            if (time.time() - cached[0]) < ttl:
+                _book_cache.move_to_end(key)
+                return cached[1]
 
-    if not entries:
-        return None
+    # HTTP buiten de lock: andere zoekopdrachten blokkeren niet
+    book_id = _search_book(author, title)
+
+    with _book_cache_lock:
+        _book_cache[key] = (time.time(), book_id)
+        _book_cache.move_to_end(key)
+        while len(_book_cache) > BOOK_CACHE_SIZE:
+            _book_cache.popitem(last=False)
+
+    return book_id
+
+
+def _search_book(author: str, title: str) -> Optional[int]:
+    """Voer de OPDS zoekopdrachten uit voor search_book (zonder cache)."""
+
+    # Probeer meerdere queries - Calibre-Web OPDS zoekt soms alleen op één veld
+    queries = (title, f"{author} {title}", author)
+    unique_queries = list(dict.fromkeys(filter(None, (q.strip() for q in queries))))
 
     # Match entries tegen auteur en titel
-    author_parts = [p.strip() for p in _normalize(author).split() if len(p.strip()) > 2]
-    title_parts = [p.strip() for p in _normalize(title).split() if len(p.strip()) > 2]
-
-    ns = {"atom": "http://www.w3.org/2005/Atom"}
-
-    for entry in entries:
-        entry_title_el = entry.find("atom:title", ns)
-        entry_title = entry_title_el.text if entry_title_el is not None else ""
-        entry_author_el = entry.find("atom:author/atom:name", ns)
-        entry_author = entry_author_el.text if entry_author_el is not None else ""
-
-        # Zoek book ID uit links (cover of download URL)
-        book_id = None
-        for link in entry.findall("atom:link", ns):
-            href = link.get("href", "")
-            book_match = re.search(r'/opds/(?:cover|download)/(\d+)', href)
-            if not book_match:
-                book_match = re.search(r'/book/(\d+)', href)
-            if book_match:
-                book_id = int(book_match.group(1))
-                break
-
-        if book_id is None:
+    author_parts = _match_parts(author)
+    title_parts = _match_parts(title)
+
+    # Eén alternation-regex per veld: één C-level scan per entry
+    author_re = re.compile("|".join(map(re.escape, author_parts))) if author_parts else None
+    title_re = re.compile("|".join(map(re.escape, title_parts))) if title_parts else None
+    match_all = author_re is None and title_re is None
+
+    # Eerste query die entries oplevert wordt gebruikt; stop bij eerste match
+    for query in unique_queries:
+        entries = _opds_search(query)
+        if entries is None:
             continue
 
-        # Match check (accent-insensitive)
-        combined = _normalize(f"{entry_title} {entry_author}")
-        author_ok = any(part in combined for part in author_parts) if author_parts else True
-        title_ok = any(part in combined for part in title_parts) if title_parts else True
+        has_entries = False
+        for entry in entries:
+            has_entries = True
+
+            # Eén pass over de children: titel, auteur en book ID uit links
+            # (cover of download URL)
+            entry_title = entry_author = None
+            book_id = None
+            for child in entry:
+                tag = child.tag
+                if tag == _ATOM_TITLE:
+                    if entry_title is None:
+                        entry_title = child.text or ""
+                elif tag == _ATOM_AUTHOR:
+                    if entry_author is None:
+                        name_el = child.find(_ATOM_NAME)
+                        if name_el is not None:
+                            entry_author = name_el.text or ""
+                elif tag == _ATOM_LINK and book_id is None:
+                    book_match = _BOOK_ID_RE.search(child.get("href", ""))
+                    if book_match:
+                        book_id = int(book_match.group(1))
+
+            if book_id is None:
+                continue
+
+            # Zonder zoekwoorden matcht elk entry met een book ID
+            if match_all:
+                return book_id
+
+            # Match check (accent-insensitive). Zoekwoorden bevatten geen
+            # spaties, dus titel en auteur kunnen los gecontroleerd worden;
+            # de auteur wordt alleen genormaliseerd als de titel niet volstaat.
+            norm_title = _normalize(entry_title or "")
+            norm_author = None
+            if title_re is not None and title_re.search(norm_title) is None:
+                norm_author = _normalize(entry_author or "")
+                if title_re.search(norm_author) is None:
+                    continue
+            if author_re is not None and author_re.search(norm_title) is None:
+                if norm_author is None:
+                    norm_author = _normalize(entry_author or "")
+                if author_re.search(norm_author) is None:
+                    continue
 
-        if author_ok and title_ok:
             return book_id
 
+        if has_entries:
+            return None
+
     return None
 
 
@@ -307,18 +600,9 @@ def _get_csrf_token(session: requests.Session, page_url: str) -> Optional[str]:
         resp.raise_for_status()
 
         # Zoek csrf_token in hidden form fields
-        csrf_match = re.search(
-            r'name=["\']csrf_token["\'][^>]*value=["\']([^"\']+)["\']',
-            resp.text
-        )
-        if not csrf_match:
-            csrf_match = re.search(
-                r'value=["\']([^"\']+)["\'][^>]*name=["\']csrf_token["\']',
-                resp.text
-            )
-
+        csrf_match = _CSRF_RE.search(resp.content)
         if csrf_match:
-            return csrf_match.group(1)
+            return (csrf_match.group(1) or csrf_match.group(2)).decode("ascii", "replace")
 
         # Fallback: check csrf_token cookie
         if "csrf_token" in session.cookies:
@@ -329,6 +613,28 @@ def _get_csrf_token(session: requests.Session, page_url: str) -> Optional[str]:
         return None
 
 
+def _get_cached_csrf_token(session: requests.Session, book_id: int) -> Optional[str]:
+    """
+    CSRF token uit cache, of vers ophalen (boekpagina, anders homepage).
+    Het token blijft geldig zolang de sessie bestaat.
+    """
+    global _csrf_cache
+
+    with _session_lock:
+        cached = _csrf_cache
+    if cached and time.time() - cached[1] < _CSRF_TTL:
+        return cached[0]
+
+    # Ophalen buiten de lock (netwerk); het laatst opgehaalde token wint
+    csrf_token = _get_csrf_token(session, f"{CALIBREWEB_URL}/book/{book_id}")
+    if not csrf_token:
+        csrf_token = _get_csrf_token(session, f"{CALIBREWEB_URL}/")
+
+    with _session_lock:
+        _csrf_cache = (csrf_token, time.time()) if csrf_token else None
+    return csrf_token
+
+
 def add_book_to_shelf(shelf_name: str, book_id: int) -> bool:
     """
     Voeg een boek toe aan een boekenplank in Calibre-Web.
@@ -337,29 +643,45 @@ def add_book_to_shelf(shelf_name: str, book_id: int) -> bool:
     """
     shelf_id = _get_shelf_id(shelf_name)
     if shelf_id is None:
-        print(f"      ✗ Plank '{shelf_name}' niet gevonden")
+        log.warning("      ✗ Plank '%s' niet gevonden", shelf_name)
         return False
 
-    session = _get_session()
-    url = f"{CALIBREWEB_URL}/shelf/add/{shelf_id}/{book_id}"
+    return add_book_to_shelf_by_id(shelf_id, book_id)
 
-    # Haal CSRF token op van de boekpagina
-    csrf_token = _get_csrf_token(session, f"{CALIBREWEB_URL}/book/{book_id}")
-    if not csrf_token:
-        csrf_token = _get_csrf_token(session, f"{CALIBREWEB_URL}/")
 
-    try:
-        headers = {"X-Requested-With": "XMLHttpRequest", "X-CSRFToken": csrf_token or ""}
-        data = {"csrf_token": csrf_token or ""}
-        resp = session.post(url, headers=headers, data=data, timeout=10, allow_redirects=True)
+def add_book_to_shelf_by_id(shelf_id: int, book_id: int) -> bool:
+    """
+    Voeg een boek toe aan een boekenplank met bekend shelf_id
+    (zie resolve_shelf_ids).
 
-        if resp.status_code in (200, 204, 302):
-            return True
+    Returns: True als succesvol
+    """
+    global _csrf_cache
+
+    session = _get_session()
+    url = _SHELF_ADD_URL.format(shelf_id=shelf_id, book_id=book_id)
+
+    try:
+        for attempt in range(2):
+            csrf_token = _get_cached_csrf_token(session, book_id)
+            headers = {"X-Requested-With": "XMLHttpRequest", "X-CSRFToken": csrf_token or ""}
+            data = {"csrf_token": csrf_token or ""}
+            resp = session.post(url, headers=headers, data=data, timeout=10, allow_redirects=True)
+
+            if resp.status_code in (200, 204, 302):
+                return True
+
+            # Verlopen token: cache wissen en één keer opnieuw proberen
+            if 400 <= resp.status_code < 500 and attempt == 0:
+                with _session_lock:
+                    _csrf_cache = None
+                continue
+            break
 
-        print(f"      ✗ Plank toevoegen mislukt: status={resp.status_code}")
+        log.warning("      ✗ Plank toevoegen mislukt: status=%s", resp.status_code)
         return False
 
     except requests.RequestException as e:
-        print(f"      ✗ Plank toevoegen mislukt: {e}")
+        log.warning("      ✗ Plank toevoegen mislukt: %s", e)
         _invalidate_session()
         return False
@@ -4,60 +4,119 @@ Database module voor wishlist applicatie.
 SQLite database met wishlist items en logs.
 """
 import sqlite3
+import hashlib
 import os
+import re
+import logging
+import time
+import atexit
+import threading
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator, Tuple
 from contextlib import contextmanager
 
+log = logging.getLogger(__name__)
+
 DB_PATH = os.environ.get("DB_PATH", "/data/wishlist.db")
 
+# In-process cache voor settings: key -> (tijdstip, waarde)
+_SETTING_CACHE: Dict[str, tuple] = {}
+SETTING_CACHE_TTL = 5  # seconden
+
+# Eén connectie per thread, hergebruikt over alle queries
+_tls = threading.local()
+_connections: Dict[threading.Thread, sqlite3.Connection] = {}
+_connections_lock = threading.Lock()
+STATEMENT_CACHE_SIZE = 64  # ruim boven het aantal verschillende queries
+
+# Minimale log level voor de logs tabel (bij module load gelezen)
+_LOG_LEVELS = {'info': 0, 'warning': 1, 'error': 2}
+_MIN_LOG_LEVEL = _LOG_LEVELS.get(os.environ.get("LOG_LEVEL", "info").lower(), 0)
+
+# Wishlist regel: auteur - "titel"
+_WISHLIST_LINE_RE = re.compile(r'^(.*?)\s*-\s*"(.+)"\s*$')
+
+# Alle geldige statussen van een wishlist item
+STATUSES = ('pending', 'searching', 'found', 'importing', 'shelved', 'failed')
+
+
+def _get_conn() -> sqlite3.Connection:
+    """Geef de connectie van deze thread; wordt bij eerste gebruik geopend."""
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        return conn
+
+    # Gebruik timeout van 30 seconden voor locked database.
+    # check_same_thread=False zodat _close_all alle connecties kan sluiten.
+    # sqlite3 cachet prepared statements per connectie op SQL tekst; omdat
+    # de connectie hergebruikt wordt blijven ze over alle aanroepen bewaard.
+    conn = sqlite3.connect(
+        DB_PATH, timeout=30.0, isolation_level=None, check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+
+    conn.row_factory = sqlite3.Row
+
+    # Enable Write-Ahead Logging voor betere concurrency (eenmalig per connectie)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    # Logs worden via ON DELETE CASCADE met hun item verwijderd
+    conn.execute("PRAGMA foreign_keys=ON")
+    # WAL + NORMAL: geen fsync per commit, alleen bij checkpoints
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")  # ~64 MB page cache
+    conn.execute("PRAGMA mmap_size=134217728")  # 128 MB
+
+    _tls.conn = conn
+    with _connections_lock:
+        # Ruim connecties op van threads die niet meer bestaan (bv. thread pools)
+        for thread in [t for t in _connections if not t.is_alive()]:
+            _connections.pop(thread).close()
+        _connections[threading.current_thread()] = conn
+    return conn
+
+
+def _close_all() -> None:
+    """Sluit alle thread connecties (bij afsluiten van het proces)."""
+    with _connections_lock:
+        for conn in _connections.values():
+            try:
+                # Laat SQLite statistieken bijwerken waar nodig (goedkoop)
+                conn.execute("PRAGMA optimize")
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+
+
+atexit.register(_close_all)
+
 
 @contextmanager
 def get_db():
-    """Context manager voor database connectie."""
-    import sys
-
+    """Context manager voor de (hergebruikte) database connectie van deze thread."""
+    conn = _get_conn()
     try:
-        # Gebruik timeout van 30 seconden voor locked database
-        conn = sqlite3.connect(DB_PATH, timeout=30.0, isolation_level=None)
-        conn.row_factory = sqlite3.Row
-
-        # Enable Write-Ahead Logging voor betere concurrency
-        conn.execute("PRAGMA journal_mode=WAL")
-        conn.execute("PRAGMA busy_timeout=30000")
-
-        try:
-            yield conn
-            conn.commit()
-        except sqlite3.OperationalError as e:
-            print(f"[DB ERROR] SQLite error: {e}", file=sys.stderr)
-            conn.rollback()
-            raise
-        except Exception as e:
-            print(f"[DB ERROR] {type(e).__name__}: {e}", file=sys.stderr)
+        yield conn
+    except Exception as e:
+        log.debug("[DB ERROR] %s: %s", type(e).__name__, e)
+        if conn.in_transaction:
             conn.rollback()
-            raise
-    except sqlite3.OperationalError as e:
-        print(f"[DB ERROR] Cannot connect: {e}", file=sys.stderr)
         raise
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
 
 
 def init_db() -> None:
     """Initialiseer database schema."""
-    # Zorg dat data directory bestaat met juiste permissions
-    data_dir = os.path.dirname(DB_PATH)
-    os.makedirs(data_dir, exist_ok=True)
+    # Eerste start: zorg dat data directory bestaat met juiste permissions
+    if not os.path.exists(DB_PATH):
+        data_dir = os.path.dirname(DB_PATH)
+        os.makedirs(data_dir, exist_ok=True)
 
-    # Set permissions op data directory
-    try:
-        os.chmod(data_dir, 0o777)
-    except Exception as e:
-        print(f"Waarschuwing: Kon permissions niet zetten op {data_dir}: {e}")
+        try:
+            os.chmod(data_dir, 0o777)
+        except Exception as e:
+            print(f"Waarschuwing: Kon permissions niet zetten op {data_dir}: {e}")
 
     with get_db() as conn:
         conn.executescript("""
@@ -80,7 +139,9 @@ def init_db() -> None:
                 timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
                 level TEXT,
                 message TEXT,
-                FOREIGN KEY (wishlist_id) REFERENCES wishlist(id)
+                author TEXT,
+                title TEXT,
+                FOREIGN KEY (wishlist_id) REFERENCES wishlist(id) ON DELETE CASCADE
             );
 
             CREATE TABLE IF NOT EXISTS settings (
@@ -88,7 +149,15 @@ def init_db() -> None:
                 value TEXT
             );
 
+            CREATE TABLE IF NOT EXISTS spotweb_cache (
+                query_hash BLOB PRIMARY KEY,
+                last_checked REAL NOT NULL,
+                misses INTEGER NOT NULL DEFAULT 0,
+                result TEXT
+            );
+
             CREATE INDEX IF NOT EXISTS idx_wishlist_status ON wishlist(status);
+            CREATE INDEX IF NOT EXISTS idx_wishlist_added_date ON wishlist(added_date);
             CREATE INDEX IF NOT EXISTS idx_logs_wishlist ON logs(wishlist_id);
             CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp);
         """)
@@ -100,14 +169,69 @@ def init_db() -> None:
             conn.execute("ALTER TABLE wishlist ADD COLUMN shelf_name TEXT")
             print("Database migratie: shelf_name kolom toegevoegd")
 
-    # Set permissions op database file en WAL files
+        # Migratie: logs tabel opnieuw opbouwen met ON DELETE CASCADE
+        logs_sql = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'logs'"
+        ).fetchone()[0]
+        if "ON DELETE CASCADE" not in logs_sql:
+            conn.execute("PRAGMA foreign_keys=OFF")
+            try:
+                conn.executescript("""
+                    BEGIN;
+                    CREATE TABLE logs_new (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        wishlist_id INTEGER,
+                        timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+                        level TEXT,
+                        message TEXT,
+                        FOREIGN KEY (wishlist_id) REFERENCES wishlist(id) ON DELETE CASCADE
+                    );
+                    INSERT INTO logs_new (id, wishlist_id, timestamp, level, message)
+                        SELECT id, wishlist_id, timestamp, level, message FROM logs;
+                    DROP TABLE logs;
+                    ALTER TABLE logs_new RENAME TO logs;
+                    CREATE INDEX idx_logs_wishlist ON logs(wishlist_id);
+                    CREATE INDEX idx_logs_timestamp ON logs(timestamp);
+                    COMMIT;
+                """)
+            finally:
+                conn.execute("PRAGMA foreign_keys=ON")
+            print("Database migratie: logs met ON DELETE CASCADE")
+
+        # Migratie: auteur/titel in logs (geen JOIN nodig in get_logs)
+        try:
+            conn.execute("SELECT author, title FROM logs LIMIT 1")
+        except sqlite3.OperationalError:
+            conn.executescript("""
+                BEGIN;
+                ALTER TABLE logs ADD COLUMN author TEXT;
+                ALTER TABLE logs ADD COLUMN title TEXT;
+                UPDATE logs SET
+                    author = (SELECT author FROM wishlist WHERE id = logs.wishlist_id),
+                    title = (SELECT title FROM wishlist WHERE id = logs.wishlist_id)
+                WHERE wishlist_id IS NOT NULL;
+                COMMIT;
+            """)
+            print("Database migratie: author/title kolommen in logs toegevoegd")
+
+        # Migratie: duplicaten (auteur, titel) in het schema afdwingen
+        try:
+            conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_wishlist_author_title "
+                "ON wishlist(author, title)"
+            )
+        except sqlite3.IntegrityError:
+            print("Waarschuwing: dubbele items in wishlist, unieke index niet aangemaakt")
+
+    # Set permissions op database file en WAL files (alleen als nodig)
     try:
-        if os.path.exists(DB_PATH):
-            os.chmod(DB_PATH, 0o666)
-        if os.path.exists(DB_PATH + "-wal"):
-            os.chmod(DB_PATH + "-wal", 0o666)
-        if os.path.exists(DB_PATH + "-shm"):
-            os.chmod(DB_PATH + "-shm", 0o666)
+        for path in (DB_PATH, DB_PATH + "-wal", DB_PATH + "-shm"):
+            try:
+                mode = os.stat(path).st_mode
+            except FileNotFoundError:
+                continue
+            if mode & 0o666 != 0o666:
+                os.chmod(path, 0o666)
     except Exception as e:
         print(f"Waarschuwing: Kon permissions niet zetten op database files: {e}")
 
@@ -131,12 +255,13 @@ def migrate_from_txt(txt_path: str) -> int:
         print("Wishlist.txt is leeg, skip migratie")
         return 0
 
-    migrated = 0
     with get_db() as conn:
+        existing = set(map(tuple, conn.execute("SELECT author, title FROM wishlist")))
+
+        rows = []
         for line in lines:
             # Parse: auteur - "titel"
-            import re
-            m = re.match(r'^(.*?)\s*-\s*"(.+)"\s*$', line)
+            m = _WISHLIST_LINE_RE.match(line)
             if not m:
                 print(f"Skip ongeldige regel: {line}")
                 continue
@@ -144,24 +269,29 @@ def migrate_from_txt(txt_path: str) -> int:
             author = m.group(1).strip()
             title = m.group(2).strip()
 
-            # Check of al bestaat
-            existing = conn.execute(
-                "SELECT id FROM wishlist WHERE author = ? AND title = ?",
-                (author, title)
-            ).fetchone()
-
-            if existing:
+            # Check of al bestaat (ook dubbelen binnen het bestand)
+            if (author, title) in existing:
                 print(f"Item al in database: {line}")
                 continue
 
-            conn.execute(
-                """INSERT INTO wishlist (author, title, raw_line, added_via)
-                   VALUES (?, ?, ?, 'migration')""",
-                (author, title, line)
-            )
-            migrated += 1
+            existing.add((author, title))
+            rows.append((author, title, line))
             print(f"Gemigreerd: {line}")
 
+        # Alles in één transactie
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            """INSERT INTO wishlist (author, title, raw_line, added_via)
+               VALUES (?, ?, ?, 'migration')""",
+            rows
+        )
+        conn.execute("COMMIT")
+
+        # Planner statistieken bijwerken na bulk insert
+        if rows:
+            conn.execute("ANALYZE")
+
+    migrated = len(rows)
     print(f"✓ {migrated} items gemigreerd van {txt_path}")
     return migrated
 
@@ -171,49 +301,114 @@ def migrate_from_txt(txt_path: str) -> int:
 def add_wishlist_item(author: str, title: str, added_via: str = "web",
                      shelf_name: Optional[str] = None) -> int:
     """Voeg nieuw item toe aan wishlist."""
-    raw_line = f'{author} - "{title}"'
+    item_id = add_wishlist_items_bulk([(author, title, shelf_name)], added_via)[0]
+    if item_id is None:
+        raise ValueError(f'Item bestaat al: {author} - "{title}"')
+    return item_id
 
-    with get_db() as conn:
-        # Check duplicaat
-        existing = conn.execute(
-            "SELECT id FROM wishlist WHERE author = ? AND title = ?",
-            (author, title)
-        ).fetchone()
 
-        if existing:
-            raise ValueError(f"Item bestaat al: {raw_line}")
+def add_wishlist_items_bulk(
+    items: List[Tuple[str, str, Optional[str]]],
+    added_via: str = "web"
+) -> List[Optional[int]]:
+    """
+    Voeg meerdere (author, title, shelf_name) items toe in één transactie.
 
-        cursor = conn.execute(
-            """INSERT INTO wishlist (author, title, raw_line, added_via, shelf_name)
-               VALUES (?, ?, ?, ?, ?)""",
-            (author, title, raw_line, added_via, shelf_name)
-        )
-        item_id = cursor.lastrowid
+    Returns: per item het nieuwe id, of None als het al bestond
+    """
+    log_wanted = _log_wanted("info")
+    log_msg = f"Item toegevoegd via {added_via}"
+    item_ids: List[Optional[int]] = []
 
-        if is_logging_enabled():
-            conn.execute(
-                """INSERT INTO logs (wishlist_id, level, message)
-                   VALUES (?, ?, ?)""",
-                (item_id, "info", f"Item toegevoegd via {added_via}")
+    with get_db() as conn:
+        # Items en logs in één transactie (één commit)
+        conn.execute("BEGIN")
+
+        for author, title, shelf_name in items:
+            raw_line = f'{author} - "{title}"'
+
+            # Duplicaat check in dezelfde statement (via idx_wishlist_author_title);
+            # NOT EXISTS werkt ook op oude databases zonder unieke index
+            cursor = conn.execute(
+                """INSERT OR IGNORE INTO wishlist (author, title, raw_line, added_via, shelf_name)
+                   SELECT ?, ?, ?, ?, ?
+                   WHERE NOT EXISTS (SELECT 1 FROM wishlist WHERE author = ? AND title = ?)""",
+                (author, title, raw_line, added_via, shelf_name, author, title)
             )
+            if cursor.rowcount == 0:
+                item_ids.append(None)
+                continue
+
+            item_id = cursor.lastrowid
+            item_ids.append(item_id)
+
+            # Opnieuw toegevoegd: geen backoff van een eerder verwijderd item
+            clear_spotweb_cache(author, title, conn=conn)
+            if log_wanted:
+                _insert_log(conn, item_id, "info", log_msg)
+
+        conn.execute("COMMIT")
+
+    return item_ids
+
 
-        return item_id
+def iter_wishlist_items(
+    status: Optional[str] = None,
+    before: Optional[Tuple[str, int]] = None,
+    limit: Optional[int] = None
+) -> Iterator[sqlite3.Row]:
+    """Als get_wishlist_items, maar levert items één voor één (voor streaming)."""
+    where = []
+    params: List[Any] = []
 
+    if status:
+        where.append("status = ?")
+        params.append(status)
+
+    # Keyset paginatie: alles na cursor `before` in (added_date, id) volgorde.
+    # Expliciete waarden: blijft werken als dat item intussen verwijderd is
+    if before is not None:
+        where.append("(added_date, id) < (?, ?)")
+        params.extend(before)
+
+    sql = "SELECT * FROM wishlist"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY added_date DESC, id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
 
-def get_wishlist_items(status: Optional[str] = None) -> List[Dict[str, Any]]:
-    """Haal wishlist items op, optioneel gefilterd op status."""
     with get_db() as conn:
-        if status:
-            rows = conn.execute(
-                "SELECT * FROM wishlist WHERE status = ? ORDER BY added_date DESC",
-                (status,)
-            ).fetchall()
-        else:
-            rows = conn.execute(
-                "SELECT * FROM wishlist ORDER BY added_date DESC"
-            ).fetchall()
+        yield from conn.execute(sql, params)
+
+
+def get_wishlist_items(
+    status: Optional[str] = None,
+    before: Optional[Tuple[str, int]] = None,
+    limit: Optional[int] = None
+) -> List[sqlite3.Row]:
+    """
+    Haal wishlist items op, optioneel gefilterd op status.
+    Rijen zijn sqlite3.Row (item['author']); geen dict kopie per rij.
+
+    Paginatie: geef (added_date, id) van het laatste item van de vorige pagina
+    als `before` (keyset, via idx_wishlist_added_date). Zonder limit: alles.
+    """
+    return list(iter_wishlist_items(status, before, limit))
+
 
-        return [dict(row) for row in rows]
+def get_status_counts() -> Dict[str, int]:
+    """Tel items per status met een enkele GROUP BY query."""
+    with get_db() as conn:
+        rows = conn.execute(
+            "SELECT status, COUNT(*) FROM wishlist GROUP BY status"
+        ).fetchall()
+
+    counts = dict.fromkeys(STATUSES, 0)
+    for status, count in rows:
+        counts[status] = count
+    return counts
 
 
 def get_wishlist_item(item_id: int) -> Optional[Dict[str, Any]]:
@@ -226,63 +421,57 @@ def get_wishlist_item(item_id: int) -> Optional[Dict[str, Any]]:
         return dict(row) if row else None
 
 
+def status_log_message(status: str, error_message: Optional[str] = None) -> str:
+    """Log tekst voor een statuswijziging."""
+    if error_message:
+        return f"Status: {status} - {error_message}"
+    return f"Status: {status}"
+
+
 def update_wishlist_status(
     item_id: int,
     status: str,
     nzb_url: Optional[str] = None,
-    error_message: Optional[str] = None
+    error_message: Optional[str] = None,
+    log: bool = True
 ) -> None:
-    """Update status van wishlist item."""
+    """
+    Update status van wishlist item. Met log=False schrijft de aanroeper
+    de status log zelf (zie status_log_message).
+    """
+    log_wanted = log and _log_wanted("info")
+
     with get_db() as conn:
         now = datetime.now().isoformat()
 
-        conn.execute(
+        # Update en log in één transactie (één commit)
+        conn.execute("BEGIN")
+        cursor = conn.execute(
             """UPDATE wishlist
                SET status = ?, last_search = ?, nzb_url = ?, error_message = ?
                WHERE id = ?""",
             (status, now, nzb_url, error_message, item_id)
         )
 
-        if is_logging_enabled():
-            log_msg = f"Status: {status}"
-            if error_message:
-                log_msg += f" - {error_message}"
+        # Item kan intussen verwijderd zijn (foreign key op logs)
+        if cursor.rowcount and log_wanted:
+            _insert_log(conn, item_id, "info", status_log_message(status, error_message))
 
-            conn.execute(
-                """INSERT INTO logs (wishlist_id, level, message)
-                   VALUES (?, ?, ?)""",
-                (item_id, "info", log_msg)
-            )
+        conn.execute("COMMIT")
 
 
 def delete_wishlist_item(item_id: int) -> bool:
     """Verwijder item uit wishlist."""
     with get_db() as conn:
+        # Logs worden via ON DELETE CASCADE mee verwijderd
         cursor = conn.execute("DELETE FROM wishlist WHERE id = ?", (item_id,))
-        deleted = cursor.rowcount > 0
-
-        if deleted:
-            # Ook logs verwijderen
-            conn.execute("DELETE FROM logs WHERE wishlist_id = ?", (item_id,))
-
-        return deleted
+        return cursor.rowcount > 0
 
 
 def bulk_delete_by_status(status: str) -> int:
     """Verwijder alle items met een specifieke status."""
     with get_db() as conn:
-        # Haal eerst alle IDs op
-        cursor = conn.execute("SELECT id FROM wishlist WHERE status = ?", (status,))
-        item_ids = [row[0] for row in cursor.fetchall()]
-
-        if not item_ids:
-            return 0
-
-        # Verwijder logs voor deze items
-        placeholders = ','.join('?' * len(item_ids))
-        conn.execute(f"DELETE FROM logs WHERE wishlist_id IN ({placeholders})", item_ids)
-
-        # Verwijder de items zelf
+        # Logs worden via ON DELETE CASCADE mee verwijderd
         cursor = conn.execute("DELETE FROM wishlist WHERE status = ?", (status,))
         return cursor.rowcount
 
@@ -294,60 +483,118 @@ def is_logging_enabled() -> bool:
     return get_setting('logging_enabled', 'true') == 'true'
 
 
+def _log_wanted(level: str) -> bool:
+    """Check LOG_LEVEL en de logging instelling (errors altijd)."""
+    if level == 'error':
+        return True
+    if _LOG_LEVELS.get(level, 0) < _MIN_LOG_LEVEL:
+        return False
+    return is_logging_enabled()
+
+
+def _insert_log(
+    conn: sqlite3.Connection,
+    wishlist_id: Optional[int],
+    level: str,
+    message: str
+) -> None:
+    """
+    Schrijf log entry met de connectie van de aanroeper. Auteur en titel
+    worden meegeschreven (ze veranderen niet), zodat get_logs geen JOIN nodig heeft.
+    """
+    try:
+        conn.execute(
+            """INSERT INTO logs (wishlist_id, level, message, author, title)
+               VALUES (?, ?, ?,
+                       (SELECT author FROM wishlist WHERE id = ?),
+                       (SELECT title FROM wishlist WHERE id = ?))""",
+            (wishlist_id, level, message, wishlist_id, wishlist_id)
+        )
+    except sqlite3.IntegrityError:
+        # Item is intussen verwijderd; log is niet meer relevant
+        pass
+
+
 def add_log(
     wishlist_id: Optional[int],
     level: str,
     message: str
 ) -> None:
-    """Voeg log entry toe. Respecteert logging instelling (errors altijd)."""
-    if level != 'error' and not is_logging_enabled():
+    """
+    Voeg log entry toe. Respecteert LOG_LEVEL en de logging instelling
+    (errors altijd).
+    """
+    if not _log_wanted(level):
         return
 
     with get_db() as conn:
-        conn.execute(
-            """INSERT INTO logs (wishlist_id, level, message)
-               VALUES (?, ?, ?)""",
-            (wishlist_id, level, message)
-        )
+        _insert_log(conn, wishlist_id, level, message)
 
 
-def get_logs(
+def add_logs(entries: List[Tuple[Optional[int], str, str]]) -> None:
+    """Voeg meerdere (wishlist_id, level, message) logs toe in één transactie."""
+    entries = [e for e in entries if _log_wanted(e[1])]
+    if not entries:
+        return
+
+    with get_db() as conn:
+        conn.execute("BEGIN")
+        for wishlist_id, level, message in entries:
+            _insert_log(conn, wishlist_id, level, message)
+        conn.execute("COMMIT")
+
+
+def iter_logs(
     wishlist_id: Optional[int] = None,
     limit: int = 100
-) -> List[Dict[str, Any]]:
-    """Haal logs op, optioneel gefilterd op wishlist_id."""
+) -> Iterator[sqlite3.Row]:
+    """Als get_logs, maar levert log entries één voor één (voor streaming)."""
     with get_db() as conn:
         if wishlist_id is not None:
-            rows = conn.execute(
+            cursor = conn.execute(
                 """SELECT * FROM logs
                    WHERE wishlist_id = ?
                    ORDER BY timestamp DESC
                    LIMIT ?""",
                 (wishlist_id, limit)
-            ).fetchall()
+            )
         else:
-            rows = conn.execute(
-                """SELECT l.*, w.author, w.title
-                   FROM logs l
-                   LEFT JOIN wishlist w ON l.wishlist_id = w.id
-                   ORDER BY l.timestamp DESC
+            # Index scan (achterwaarts) op idx_logs_timestamp, zonder JOIN
+            cursor = conn.execute(
+                """SELECT * FROM logs
+                   ORDER BY timestamp DESC
                    LIMIT ?""",
                 (limit,)
-            ).fetchall()
+            )
 
-        return [dict(row) for row in rows]
+        yield from cursor
+
+
+def get_logs(
+    wishlist_id: Optional[int] = None,
+    limit: int = 100
+) -> List[sqlite3.Row]:
+    """Haal logs op (als sqlite3.Row), optioneel gefilterd op wishlist_id."""
+    return list(iter_logs(wishlist_id, limit))
 
 
 # ===== SETTINGS =====
 
 def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
-    """Haal setting op."""
-    with get_db() as conn:
-        row = conn.execute(
-            "SELECT value FROM settings WHERE key = ?",
-            (key,)
-        ).fetchone()
-        return row["value"] if row else default
+    """Haal setting op (met korte in-process cache)."""
+    cached = _SETTING_CACHE.get(key)
+    if cached is not None and time.monotonic() - cached[0] < SETTING_CACHE_TTL:
+        value = cached[1]
+    else:
+        with get_db() as conn:
+            row = conn.execute(
+                "SELECT value FROM settings WHERE key = ?",
+                (key,)
+            ).fetchone()
+        value = row["value"] if row else None
+        _SETTING_CACHE[key] = (time.monotonic(), value)
+
+    return value if value is not None else default
 
 
 def set_setting(key: str, value: str) -> None:
@@ -358,6 +605,48 @@ def set_setting(key: str, value: str) -> None:
                VALUES (?, ?)""",
             (key, value)
         )
+    _SETTING_CACHE[key] = (time.monotonic(), value)
+
+
+# ===== SPOTWEB CACHE =====
+
+def _spotweb_key(author: str, title: str) -> bytes:
+    """Sleutel voor de Spotweb cache van een item."""
+    return hashlib.blake2b(f"{author}\n{title}".encode(), digest_size=8).digest()
+
+
+def get_spotweb_cache(author: str, title: str) -> Optional[sqlite3.Row]:
+    """Laatste zoekresultaat voor een item (last_checked, misses, result)."""
+    with get_db() as conn:
+        return conn.execute(
+            "SELECT last_checked, misses, result FROM spotweb_cache WHERE query_hash = ?",
+            (_spotweb_key(author, title),)
+        ).fetchone()
+
+
+def set_spotweb_cache(author: str, title: str, result: Optional[str]) -> None:
+    """Sla zoekresultaat op; None telt als (opeenvolgende) miss."""
+    with get_db() as conn:
+        conn.execute(
+            """INSERT INTO spotweb_cache (query_hash, last_checked, misses, result)
+               VALUES (?, ?, ?, ?)
+               ON CONFLICT(query_hash) DO UPDATE SET
+                   last_checked = excluded.last_checked,
+                   misses = CASE WHEN excluded.result IS NULL
+                                 THEN spotweb_cache.misses + 1 ELSE 0 END,
+                   result = excluded.result""",
+            (_spotweb_key(author, title), time.time(), 0 if result else 1, result)
+        )
+
+
+def clear_spotweb_cache(author: str, title: str, conn: Optional[sqlite3.Connection] = None) -> None:
+    """Vergeet eerdere zoekresultaten (en miss-backoff) van een item."""
+    if conn is not None:
+        conn.execute("DELETE FROM spotweb_cache WHERE query_hash = ?", (_spotweb_key(author, title),))
+        return
+
+    with get_db() as conn:
+        conn.execute("DELETE FROM spotweb_cache WHERE query_hash = ?", (_spotweb_key(author, title),))
 
 
 if __name__ == "__main__":
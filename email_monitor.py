@@ -10,7 +10,8 @@ Setup Gmail:
 4. Use App Password in EMAIL_PASSWORD env var
 """
 import os
-import time
+import signal
+import threading
 import imaplib
 import email
 from email.header import decode_header
@@ -30,6 +31,26 @@ CHECK_INTERVAL = int(os.environ.get('EMAIL_CHECK_INTERVAL', '300'))  # 5 minuten
 INBOX_FOLDER = os.environ.get('EMAIL_INBOX_FOLDER', 'INBOX')
 PROCESSED_FOLDER = os.environ.get('EMAIL_PROCESSED_FOLDER', 'Wishlist/Processed')
 ALLOWED_SENDERS = os.environ.get('EMAIL_ALLOWED_SENDERS', '').split(',')
+# Eenmalig opgeschoond voor is_sender_allowed
+_ALLOWED_SENDERS = tuple(s.strip().lower() for s in ALLOWED_SENDERS if s.strip())
+
+# Alleen benodigde headers en het begin van de body ophalen (wishlist regels
+# zijn kort); PEEK zodat de \Seen flag expliciet gezet wordt
+BODY_MAX_BYTES = 65536
+FETCH_QUERY = (
+    '(BODY.PEEK[HEADER.FIELDS (FROM SUBJECT CONTENT-TYPE CONTENT-TRANSFER-ENCODING)] '
+    f'BODY.PEEK[TEXT]<0.{BODY_MAX_BYTES}>)'
+)
+
+# Patroon: auteur - "titel" optioneel > plank
+_ITEM_RE = re.compile(r'([^-"]+?)\s*-\s*["\u201C]([^"\u201D]+)["\u201D]\s*(?:>\s*(.+?))?\s*$')
+# Zelfde patroon voor de hele body in één scan: per regel, optionele prefix
+_BODY_ITEM_RE = re.compile(
+    r'(?:^[ \t]*(?:wishlist|voeg toe|add):[ \t]*)?'
+    r'([^-"\n]+?)[ \t]*-[ \t]*["\u201C]([^"\u201D\n]+)["\u201D]'
+    r'[ \t]*(?:>[ \t]*([^\n]+?))?[ \t\r]*$',
+    re.MULTILINE | re.IGNORECASE
+)
 
 
 def decode_header_value(header_value: str) -> str:
@@ -37,6 +58,10 @@ def decode_header_value(header_value: str) -> str:
     if not header_value:
         return ''
 
+    # Gewone ASCII header zonder encoded-words: niets te decoderen
+    if header_value.isascii() and '=?' not in header_value:
+        return header_value
+
     decoded_parts = decode_header(header_value)
     result = []
 
@@ -66,78 +91,58 @@ def extract_wishlist_items(subject: str, body: str) -> List[Tuple[str, str, Opti
     """
     items = []
 
-    # Patroon: auteur - "titel" optioneel > plank
-    pattern = r'([^-"]+?)\s*-\s*["\u201C]([^"\u201D]+)["\u201D]\s*(?:>\s*(.+?))?\s*$'
-
     # Probeer subject
-    for match in re.finditer(pattern, subject):
+    for match in _ITEM_RE.finditer(subject):
         author = match.group(1).strip()
         title = match.group(2).strip()
         shelf = (match.group(3) or '').strip() or None
         if author and title:
             items.append((author, title, shelf))
 
-    # Probeer body (elke regel)
-    for line in body.split('\n'):
-        line = line.strip()
-
-        # Skip lege regels en replies
-        if not line or line.startswith('>'):
+    # Probeer body (alle regels in één scan)
+    for match in _BODY_ITEM_RE.finditer(body):
+        # Skip replies (regel begint met '>')
+        line_start = body.rfind('\n', 0, match.start()) + 1
+        if body[line_start:match.end()].lstrip().startswith('>'):
             continue
 
-        # Verwijder prefixes
-        line = re.sub(r'^(wishlist|voeg toe|add):\s*', '', line, flags=re.IGNORECASE)
-
-        for match in re.finditer(pattern, line):
-            author = match.group(1).strip()
-            title = match.group(2).strip()
-            shelf = (match.group(3) or '').strip() or None
-            if author and title:
-                items.append((author, title, shelf))
+        author = match.group(1).strip()
+        title = match.group(2).strip()
+        shelf = (match.group(3) or '').strip() or None
+        if author and title:
+            items.append((author, title, shelf))
 
     return items
 
 
 def get_email_body(msg) -> str:
-    """Haal email body op (plain text)."""
-    body = ''
-
-    if msg.is_multipart():
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            if content_type == 'text/plain':
-                try:
-                    charset = part.get_content_charset() or 'utf-8'
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        body = payload.decode(charset, errors='ignore')
-                        break
-                except Exception as e:
-                    print(f"Fout bij lezen email body: {e}")
-    else:
+    """Haal email body op (plain text): de eerste text/plain part die decodeert."""
+    # Niet-multipart: het bericht zelf, ongeacht content type
+    multipart = msg.is_multipart()
+    parts = msg.walk() if multipart else (msg,)
+
+    for part in parts:
+        # Containers, HTML en bijlagen worden niet gedecodeerd
+        if multipart and part.get_content_type() != 'text/plain':
+            continue
         try:
-            charset = msg.get_content_charset() or 'utf-8'
-            payload = msg.get_payload(decode=True)
+            payload = part.get_payload(decode=True)
             if payload:
-                body = payload.decode(charset, errors='ignore')
+                return payload.decode(part.get_content_charset() or 'utf-8', errors='ignore')
         except Exception as e:
             print(f"Fout bij lezen email body: {e}")
 
-    return body
+    return ''
 
 
 def is_sender_allowed(sender: str) -> bool:
     """Check of sender toegestaan is."""
-    if not ALLOWED_SENDERS or not ALLOWED_SENDERS[0]:
+    if not _ALLOWED_SENDERS:
         # Geen whitelist = alle senders toegestaan
         return True
 
     sender_lower = sender.lower()
-    for allowed in ALLOWED_SENDERS:
-        if allowed.strip().lower() in sender_lower:
-            return True
-
-    return False
+    return any(allowed in sender_lower for allowed in _ALLOWED_SENDERS)
 
 
 def process_email(mail: imaplib.IMAP4_SSL, email_id: bytes) -> int:
@@ -148,10 +153,16 @@ def process_email(mail: imaplib.IMAP4_SSL, email_id: bytes) -> int:
     added_count = 0
 
     try:
-        # Haal email op
-        _, msg_data = mail.fetch(email_id, '(RFC822)')
-        email_body = msg_data[0][1]
-        msg = email.message_from_bytes(email_body)
+        # Haal headers en (begin van) body op, niet het hele bericht
+        _, msg_data = mail.fetch(email_id, FETCH_QUERY)
+        header_bytes = text_bytes = b''
+        for part in msg_data:
+            if isinstance(part, tuple):
+                if b'HEADER' in part[0]:
+                    header_bytes = part[1]
+                else:
+                    text_bytes = part[1]
+        msg = email.message_from_bytes(header_bytes + text_bytes)
 
         # Parse headers
         from_header = decode_header_value(msg.get('From', ''))
@@ -173,24 +184,22 @@ def process_email(mail: imaplib.IMAP4_SSL, email_id: bytes) -> int:
             print("   Geen wishlist items gevonden")
             return 0
 
-        # Voeg items toe
-        for author, title, shelf_name in items:
-            try:
-                item_id = db.add_wishlist_item(
-                    author=author,
-                    title=title,
-                    added_via='email',
-                    shelf_name=shelf_name
-                )
-                shelf_msg = f" → {shelf_name}" if shelf_name else ""
-                print(f"   ✓ Toegevoegd: {author} - \"{title}\"{shelf_msg}")
-                added_count += 1
-
-            except ValueError as e:
+        # Voeg items toe in één transactie
+        try:
+            item_ids = db.add_wishlist_items_bulk(items, added_via='email')
+        except Exception as e:
+            print(f"   ✗ Fout bij toevoegen: {e}")
+            return 0
+
+        for (author, title, shelf_name), item_id in zip(items, item_ids):
+            if item_id is None:
                 # Duplicaat
                 print(f"   ⊗ Al in lijst: {author} - \"{title}\"")
-            except Exception as e:
-                print(f"   ✗ Fout bij toevoegen: {e}")
+                continue
+
+            shelf_msg = f" → {shelf_name}" if shelf_name else ""
+            print(f"   ✓ Toegevoegd: {author} - \"{title}\"{shelf_msg}")
+            added_count += 1
 
     except Exception as e:
         print(f"Fout bij verwerken email: {e}")
@@ -243,9 +252,10 @@ def check_mailbox() -> int:
         for email_id in email_ids:
             added = process_email(mail, email_id)
 
+            # Markeer als gelezen (fetch gebruikt BODY.PEEK)
+            mail.store(email_id, '+FLAGS', '\\Seen')
+
             if added > 0:
-                # Markeer als gelezen
-                mail.store(email_id, '+FLAGS', '\\Seen')
                 processed_count += 1
 
                 # Optioneel: verplaats naar processed folder
@@ -273,6 +283,10 @@ def check_mailbox() -> int:
     return processed_count
 
 
+# Gezet bij SIGTERM/SIGINT: wachten tussen checks wordt direct onderbroken
+_stop = threading.Event()
+
+
 def main():
     """Main loop voor email monitoring."""
     print("📧 Email Monitor gestart")
@@ -280,12 +294,15 @@ def main():
     print(f"   Account: {EMAIL_ADDRESS}")
     print(f"   Interval: {CHECK_INTERVAL}s")
 
-    if ALLOWED_SENDERS and ALLOWED_SENDERS[0]:
-        print(f"   Whitelist: {', '.join(ALLOWED_SENDERS)}")
+    if _ALLOWED_SENDERS:
+        print(f"   Whitelist: {', '.join(_ALLOWED_SENDERS)}")
     else:
         print("   ⚠️ Geen sender whitelist - alle emails worden geaccepteerd")
 
-    while True:
+    signal.signal(signal.SIGTERM, lambda *_: _stop.set())
+    signal.signal(signal.SIGINT, lambda *_: _stop.set())
+
+    while not _stop.is_set():
         try:
             processed = check_mailbox()
             if processed > 0:
@@ -294,7 +311,9 @@ def main():
             print(f"❌ Fout in main loop: {e}")
 
         print(f"Volgende check over {CHECK_INTERVAL}s...")
-        time.sleep(CHECK_INTERVAL)
+        _stop.wait(CHECK_INTERVAL)
+
+    print("📧 Email Monitor gestopt")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,13 @@
+"""
+Gunicorn configuratie voor de Wishlist web app.
+Eén proces met meerdere threads: zoekactie- en update-status worden
+in-process bijgehouden, en SQLite/netwerk I/O geeft de GIL vrij zodat
+threads verzoeken parallel kunnen afhandelen.
+"""
+import os
+
+bind = f"{os.environ.get('FLASK_HOST', '0.0.0.0')}:{os.environ.get('FLASK_PORT', '5000')}"
+workers = 1
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', '8'))
+timeout = 60
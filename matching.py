@@ -0,0 +1,76 @@
+"""
+Gedeelde matching van Spotweb resultaten tegen wishlist items.
+Gebruikt door worker.py en wishlist.py.
+"""
+import re
+import functools
+from typing import FrozenSet, Tuple
+
+
+# ASCII fast path voor tokens (bytes.translate): alleen a-z en 0-9 blijven
+_ASCII_TOKEN_TABLE = bytes(
+    c if c in b"abcdefghijklmnopqrstuvwxyz0123456789" else 0x20 for c in range(256)
+)
+
+# Token = aaneengesloten a-z/0-9/à-ÿ; al het andere (ook '-') scheidt tokens
+_TOKEN_RE = re.compile(r"[a-z0-9à-ÿ]+")
+
+# Stopwoorden voor matching
+STOPWORDS: FrozenSet[str] = frozenset({
+    "de", "het", "een", "van", "en", "der", "den", "te", "in", "op", "voor", "met", "aan", "bij", "uit",
+    "the", "a", "an", "of", "and", "to", "in", "on", "for", "with",
+})
+
+
+@functools.lru_cache(maxsize=4096)
+def tokens(s: str) -> Tuple[str, ...]:
+    """Maak tokens van string (zonder stopwords). Gecachet: Spotweb titels komen vaak terug."""
+    s = (s or "").lower()
+    if s.isascii():
+        words = s.encode().translate(_ASCII_TOKEN_TABLE).decode().split()
+    else:
+        words = _TOKEN_RE.findall(s)
+    return tuple(w for w in words if len(w) > 1 and w not in STOPWORDS)
+
+
+def query_key(s: str) -> Tuple[str, ...]:
+    """
+    Alle woorden van een zoekopdracht (incl. stopwoorden), gesorteerd, voor het
+    ontdubbelen van varianten: hoofdletters, leestekens, spaties en woordvolgorde
+    maken voor Spotweb niet uit ("a b" en "b a" is dezelfde zoekopdracht).
+    """
+    return tuple(sorted(_TOKEN_RE.findall((s or "").lower())))
+
+
+@functools.lru_cache(maxsize=4096)
+def token_set(s: str) -> FrozenSet[str]:
+    """Tokens als frozenset; gecachet (dezelfde release komt in meerdere varianten terug)."""
+    return frozenset(tokens(s))
+
+
+def title_need(title_tokens: Tuple[str, ...]) -> int:
+    """Aantal titel tokens dat moet matchen (zie match)."""
+    return 2 if len(title_tokens) >= 3 else 1
+
+
+def match(
+    author_set: FrozenSet[str],
+    title_tokens: Tuple[str, ...],
+    need: int,
+    candidate_title: str
+) -> bool:
+    """
+    Check of candidate title past bij vooraf berekende author/titel tokens.
+
+    Logica:
+    - Minimaal 1 author token moet voorkomen in candidate
+    - Voor titel: minimaal `need` titel tokens (zie title_need)
+    """
+    candidate_tokens = token_set(candidate_title)
+
+    # Check author (set intersectie)
+    if candidate_tokens.isdisjoint(author_set):
+        return False
+
+    # Check title
+    return sum(1 for t in title_tokens if t in candidate_tokens) >= need
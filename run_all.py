@@ -8,72 +8,149 @@ import sys
 import subprocess
 import time
 import signal
+import selectors
 from threading import Thread
 
+RESTART_DELAY = 5
+
 processes = {}
+commands = {}
 shutdown_requested = False
 
+# Eén supervisor-loop: pidfd per kindproces + wakeup pipe voor signalen
+_selector = selectors.DefaultSelector()
+_pidfds = {}
+_wake_r, _wake_w = os.pipe()
+os.set_blocking(_wake_r, False)
+os.set_blocking(_wake_w, False)
 
-def start_process(name: str, script: str):
-    """Start een proces en monitor het."""
-    global shutdown_requested
 
-    while not shutdown_requested:
-        print(f"▶️  Starting {name}...")
+def _stream_output(name: str, proc: subprocess.Popen):
+    """Stream output van een proces met naam-prefix, als ruwe bytes."""
+    prefix = f"[{name}] ".encode()
+    stdout_fd = sys.stdout.fileno()
+    sys.stdout.flush()
 
-        try:
-            proc = subprocess.Popen(
-                [sys.executable, script],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1
-            )
+    for raw in iter(proc.stdout.readline, b""):
+        if raw.strip():
+            if not raw.endswith(b"\n"):
+                raw += b"\n"
+            os.write(stdout_fd, prefix + raw)
 
-            processes[name] = proc
 
-            # Stream output
-            for line in proc.stdout:
-                if line.strip():
-                    print(f"[{name}] {line.rstrip()}")
+def _wait_and_wake(proc: subprocess.Popen):
+    """Fallback zonder pidfd: wacht op exit en maak de supervisor wakker."""
+    proc.wait()
+    try:
+        os.write(_wake_w, b"\0")
+    except BlockingIOError:
+        pass
 
-            # Process beëindigd
-            proc.wait()
 
-            if shutdown_requested:
-                print(f"✓ {name} gestopt")
-                break
+def start_process(name: str) -> bool:
+    """Start een proces en registreer het bij de supervisor."""
+    print(f"▶️  Starting {name}...")
 
-            # Crash - restart na 5 seconden
-            print(f"⚠️  {name} crashed (exit code: {proc.returncode}), restart over 5s...")
-            time.sleep(5)
+    try:
+        proc = subprocess.Popen(
+            [sys.executable, *commands[name]],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=-1,
+            env={**os.environ, "PYTHONUNBUFFERED": "1"}
+        )
+    except Exception as e:
+        print(f"❌ Fout bij starten {name}: {e}")
+        return False
+
+    processes[name] = proc
+    Thread(target=_stream_output, args=(name, proc), daemon=True).start()
 
-        except Exception as e:
-            print(f"❌ Fout bij starten {name}: {e}")
-            if not shutdown_requested:
-                time.sleep(5)
+    try:
+        fd = os.pidfd_open(proc.pid)
+    except (AttributeError, OSError):
+        # Geen pidfd (kernel < 5.3, bv. Synology): wacht-thread als fallback
+        Thread(target=_wait_and_wake, args=(proc,), daemon=True).start()
+    else:
+        _pidfds[name] = fd
+        _selector.register(fd, selectors.EVENT_READ, name)
+
+    return True
+
+
+def _forget_pidfd(name: str):
+    """Verwijder de pidfd van een beëindigd proces uit de selector."""
+    fd = _pidfds.pop(name, None)
+    if fd is not None:
+        _selector.unregister(fd)
+        os.close(fd)
+
+
+def supervise(pending: dict):
+    """
+    Start processen en herstart ze na een crash.
+
+    pending: naam -> monotonic tijdstip waarop het proces (opnieuw) moet starten.
+    Exits komen binnen via pidfd's, signalen via de wakeup pipe; er wordt
+    alleen gewacht tot het eerstvolgende geplande (her)startmoment.
+    """
+    _selector.register(_wake_r, selectors.EVENT_READ)
+
+    while not shutdown_requested:
+        now = time.monotonic()
+        for name, due in list(pending.items()):
+            if due <= now:
+                del pending[name]
+                if not start_process(name):
+                    pending[name] = now + RESTART_DELAY
+
+        timeout = max(0.0, min(pending.values()) - now) if pending else None
+        for key, _ in _selector.select(timeout):
+            if key.fd == _wake_r:
+                try:
+                    while os.read(_wake_r, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+
+        if shutdown_requested:
+            break
+
+        # Crash - restart na RESTART_DELAY seconden
+        for name, proc in processes.items():
+            if name in pending or proc.poll() is None:
+                continue
+            _forget_pidfd(name)
+            print(f"⚠️  {name} crashed (exit code: {proc.returncode}), restart over {RESTART_DELAY}s...")
+            pending[name] = time.monotonic() + RESTART_DELAY
+
+    stop_processes()
 
 
 def signal_handler(signum, frame):
-    """Handle shutdown signals."""
+    """Handle shutdown signals; de supervisor stopt de processen."""
     global shutdown_requested
-    print("\n🛑 Shutdown signal ontvangen, stoppen processen...")
     shutdown_requested = True
 
-    # Stop alle processen
+
+def stop_processes():
+    """Stop alle processen."""
+    print("\n🛑 Shutdown signal ontvangen, stoppen processen...")
+
     for name, proc in processes.items():
+        if proc.poll() is not None:
+            continue
         try:
             print(f"   Stoppen {name}...")
             proc.terminate()
             proc.wait(timeout=10)
+            print(f"✓ {name} gestopt")
         except subprocess.TimeoutExpired:
             print(f"   Force kill {name}...")
             proc.kill()
         except Exception as e:
             print(f"   Fout bij stoppen {name}: {e}")
 
-    sys.exit(0)
-
 
 def main():
     """Main entry point."""
@@ -81,9 +158,10 @@ def main():
     print("📚 Wishlist Manager - Multi-Process Startup")
     print("=" * 60)
 
-    # Register signal handlers
+    # Register signal handlers; de wakeup fd maakt de supervisor wakker
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
+    signal.set_wakeup_fd(_wake_w)
 
     # Check required environment variables
     required_vars = [
@@ -107,38 +185,30 @@ def main():
     print(f"   Email monitoring: {'Enabled' if email_enabled else 'Disabled'}")
     print()
 
-    # Start processen in threads
-    threads = []
-
-    # Web app
-    t1 = Thread(target=start_process, args=("webapp", "app.py"), daemon=True)
-    t1.start()
-    threads.append(t1)
-    time.sleep(2)  # Laat web app eerst starten
-
-    # Worker
-    t2 = Thread(target=start_process, args=("worker", "worker.py"), daemon=True)
-    t2.start()
-    threads.append(t2)
+    # Web app: via gunicorn (threaded WSGI), Flask dev server alleen in debug modus
+    if os.environ.get('FLASK_DEBUG', 'false').lower() == 'true':
+        commands["webapp"] = ["app.py"]
+    else:
+        commands["webapp"] = ["-m", "gunicorn", "app:app"]
+    commands["worker"] = ["worker.py"]
 
     # Email monitor (optioneel)
     if email_enabled:
-        t3 = Thread(target=start_process, args=("email", "email_monitor.py"), daemon=True)
-        t3.start()
-        threads.append(t3)
+        commands["email"] = ["email_monitor.py"]
     else:
         print("[INFO] Email monitoring uitgeschakeld (EMAIL_ADDRESS/EMAIL_PASSWORD niet ingesteld)")
 
-    print("\n✓ Alle processen gestart")
+    # Laat web app eerst starten, de rest 2s later
+    now = time.monotonic()
+    pending = {name: now + 2 for name in commands}
+    pending["webapp"] = now
+
+    print("\n✓ Alle processen ingepland")
     print("=" * 60)
     print()
 
-    # Wacht tot shutdown
-    try:
-        while not shutdown_requested:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        signal_handler(signal.SIGINT, None)
+    supervise(pending)
+    sys.exit(0)
 
 
 if __name__ == "__main__":
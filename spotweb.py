@@ -0,0 +1,67 @@
+"""
+Gedeelde Spotweb helpers: HTTP sessie en streaming parsing van de newznab XML.
+Gebruikt door worker.py, wishlist.py en backup2wishlist.py.
+"""
+from typing import Iterator
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree
+
+
+# (connect, read) timeout: een onbereikbare host faalt snel
+HTTP_TIMEOUT = (5, 30)
+
+
+def make_session(pool_maxsize: int, user_agent: str) -> requests.Session:
+    """
+    HTTP sessie die verbindingen (keep-alive) naar Spotweb en SAB hergebruikt;
+    pool_maxsize = aantal requests dat tegelijk kan lopen.
+
+    Alleen verbindingsfouten worden opnieuw geprobeerd: na een read fout kan
+    SAB de NZB (addurl) al in de wachtrij hebben gezet.
+    """
+    session = requests.Session()
+    session.headers.update({"User-Agent": user_agent})
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(total=2, read=0, other=0, backoff_factor=0.3),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Tolerante XML parser opties (Spotweb XML is soms niet strikt valide);
+# geen entity expansie of netwerktoegang
+XML_OPTIONS = dict(recover=True, huge_tree=False, resolve_entities=False, no_network=True)
+
+# Titel en enclosure URL van een <item>, elk in één C-aanroep ("" als die ontbreekt);
+# gewone str (geen smart strings), zodat gecachete waarden de boom niet vasthouden
+ITEM_TITLE = etree.XPath("string(title)", smart_strings=False)
+ENCLOSURE_URL = etree.XPath("string(enclosure/@url)", smart_strings=False)
+
+
+def iter_spotweb_items(r: requests.Response) -> Iterator:
+    """
+    Parse <item> elementen incrementeel terwijl de response binnenkomt
+    (iter_content pakt gzip al uit); verwerkte items (en hun voorgangers)
+    worden vrijgegeven zodat de boom niet groeit.
+    """
+    parser = etree.XMLPullParser(events=("end",), tag="item", **XML_OPTIONS)
+
+    def drain():
+        for _, item in parser.read_events():
+            yield item
+            item.clear()
+            while item.getprevious() is not None:
+                del item.getparent()[0]
+
+    for chunk in r.iter_content(chunk_size=8192):
+        parser.feed(chunk)
+        yield from drain()
+
+    parser.close()
+    yield from drain()
@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 import os
-import time
+import logging
+import signal
+import threading
 import re
-import requests
-from urllib.parse import urlencode
-from lxml import etree
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 from dataclasses import dataclass
-from typing import List, Optional, Set
+from typing import Optional, Tuple
+
+from matching import match, query_key, title_need, tokens
+from spotweb import ENCLOSURE_URL, HTTP_TIMEOUT, ITEM_TITLE, iter_spotweb_items, make_session
+
+log = logging.getLogger(__name__)
 
 # ====== CONFIG via environment ======
 SPOTWEB_BASE_URL = os.environ["SPOTWEB_BASE_URL"].rstrip("/")
@@ -18,35 +24,28 @@ WISHLIST_FILE    = os.environ.get("WISHLIST_FILE", "/data/wishlist.txt")
 INTERVAL_SECONDS = int(os.environ.get("INTERVAL_SECONDS", "900"))
 SPOTWEB_CAT      = os.environ.get("SPOTWEB_CAT", "7020")   # Ebook
 SAB_CATEGORY     = os.environ.get("SAB_CATEGORY", "books")
+SAB_WORKERS      = int(os.environ.get("SAB_WORKERS", "4"))
+
+# Gezet bij SIGTERM/SIGINT: wachten tussen rondes wordt direct onderbroken
+_stop = threading.Event()
+
+# Gedeelde HTTP sessie: hergebruikt verbindingen (keep-alive) naar Spotweb en SAB
+_SESSION = make_session(8, "wishlist/1.0")
 
 
 # ============================================================
 # 1) Wishlist format: [schrijver] [schrijver] ... - "titel"
 # ============================================================
 
-STOPWORDS: Set[str] = {
-    "de","het","een","van","en","der","den","te","in","op","voor","met","aan","bij","uit",
-    "the","a","an","of","and","to","in","on","for","with",
-}
-
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class WishlistEntry:
-    authors: List[str]  # tokens (minstens 1)
+    authors: Tuple[str, ...]  # tokens (minstens 1)
     title: str          # string uit quotes
     raw: str            # originele regel
 
 
-def _norm(s: str) -> str:
-    s = (s or "").lower()
-    s = s.replace("–", "-").replace("—", "-")
-    s = re.sub(r"[^a-z0-9à-ÿ\s-]", " ", s, flags=re.UNICODE)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-
-def _tokens(s: str) -> List[str]:
-    parts = _norm(s).replace("-", " ").split()
-    return [w for w in parts if w and w not in STOPWORDS and len(w) > 1]
+_LINE_RE = re.compile(r'^(.*?)\s*-\s*"(.+)"\s*$')
+_WORD_RE = re.compile(r"[A-Za-zÀ-ÿ0-9]+")
 
 
 def parse_wishlist_line(line: str) -> Optional[WishlistEntry]:
@@ -61,15 +60,15 @@ def parse_wishlist_line(line: str) -> Optional[WishlistEntry]:
     if not raw or raw.startswith("#"):
         return None
 
-    m = re.match(r'^(.*?)\s*-\s*"(.+)"\s*$', raw)
+    m = _LINE_RE.match(raw)
     if not m:
         return None
 
     author_part = m.group(1).strip()
     title_part  = m.group(2).strip()
 
-    authors = _tokens(author_part)
-    title_tokens = _tokens(title_part)
+    authors = tokens(author_part)
+    title_tokens = tokens(title_part)
 
     if not authors or not title_tokens:
         return None
@@ -77,33 +76,6 @@ def parse_wishlist_line(line: str) -> Optional[WishlistEntry]:
     return WishlistEntry(authors=authors, title=title_part, raw=raw)
 
 
-def candidate_matches(entry: WishlistEntry, candidate_title: str) -> bool:
-    """
-    Jouw regel:
-    - minstens 1 schrijver-token moet voorkomen
-    - én de titel moet terugkomen in de gevonden woorden
-
-    Concreet:
-    - author_ok: minimaal 1 author-token in candidate
-    - title_ok:
-        - als titel >= 3 tokens: minimaal 2 titel-tokens matchen
-        - anders: minimaal 1 titel-token matchen
-    """
-    cand = set(_tokens(candidate_title))
-
-    author_ok = any(a in cand for a in entry.authors)
-    if not author_ok:
-        return False
-
-    title_tokens = _tokens(entry.title)
-    if len(title_tokens) >= 3:
-        title_ok = sum(1 for t in title_tokens if t in cand) >= 2
-    else:
-        title_ok = any(t in cand for t in title_tokens)
-
-    return author_ok and title_ok
-
-
 # ============================================================
 # 2) wishlist.txt IO (zelfde als jij had)
 # ============================================================
@@ -143,23 +115,21 @@ def search_variants(text: str) -> list[str]:
         left, right = parts
         variants.extend([left, right, f"{right} {left}", f"{left} {right}"])
 
-    words = re.findall(r"[A-Za-zÀ-ÿ0-9]+", t_norm, flags=re.UNICODE)
+    words = _WORD_RE.findall(t_norm)
     if words:
         variants.append(" ".join(words))
         variants.append(words[-1])
     if len(words) >= 3:
         variants.append(" ".join(words[-3:]))
 
-    seen = set()
-    out: list[str] = []
+    # Uniek houden op genormaliseerde woorden (eerste variant wint)
+    unique: dict[tuple, str] = {}
     for v in variants:
-        v = v.strip()
-        key = v.lower()
-        if v and key not in seen:
-            out.append(v)
-            seen.add(key)
+        key = query_key(v)
+        if key:
+            unique.setdefault(key, v.strip())
 
-    return out
+    return list(unique.values())
 
 
 # ============================================================
@@ -178,17 +148,23 @@ def spotweb_search_first_nzb_url(query: str) -> str | None:
     Tip voor integratie van matching:
     - parse entry = parse_wishlist_line(query)  (kan None zijn)
     - als entry is None: val terug op 'oude gedrag' (bijv. eerste hit)
-    - als entry bestaat: gebruik candidate_matches(entry, candidate_title)
+    - als entry bestaat: gebruik matching.match(...) met de tokens van entry
       om resultaten te filteren voordat je een url returned.
     """
     """
     Vraagt Spotweb Newznab API om resultaten en pakt de eerste enclosure URL (NZB).
     Tolerant XML parsen via lxml (recover=True), omdat Spotweb XML soms niet strikt valide is.
     """
-    parser = etree.XMLParser(recover=True)
     entry = parse_wishlist_line(query)
-    candidate_title = ""
-    print("DEBUG entry:", entry)
+    debug = log.isEnabledFor(logging.DEBUG)
+    if debug:
+        log.debug("entry: %s", entry)
+
+    # Tokens van de entry één keer berekenen, niet per kandidaat
+    if entry:
+        author_set = frozenset(entry.authors)
+        title_tokens = tokens(entry.title)
+        need = title_need(title_tokens)
     for q in search_variants(query):
         params = {
             "apikey": SPOTWEB_APIKEY,
@@ -198,37 +174,28 @@ def spotweb_search_first_nzb_url(query: str) -> str | None:
             "cat": SPOTWEB_CAT,
             "limit": "25",
         }
-        url = f"{SPOTWEB_BASE_URL}/api?{urlencode(params)}"
-        r = requests.get(url, timeout=30)
-        r.raise_for_status()
+        with _SESSION.get(f"{SPOTWEB_BASE_URL}/api", params=params, timeout=HTTP_TIMEOUT, stream=True) as r:
+            r.raise_for_status()
 
-        root = etree.fromstring(r.content, parser)
-        channel = root.find("channel")
-        if channel is None:
-            continue
+            for item in iter_spotweb_items(r):
+                candidate_title = ITEM_TITLE(item)
+                if not candidate_title:
+                    continue
 
-        for item in channel.findall("item"):
-            title_el = item.find("title")
-            if title_el is None:
-                continue
+                matches = entry is None or match(author_set, title_tokens, need, candidate_title)
 
-            candidate_title = title_el.text or ""
-            
-            print("DEBUG candidate_title:", repr(candidate_title))
-            print("DEBUG author tokens:", entry.authors if entry else None)
-            print("DEBUG title tokens:", _tokens(entry.title) if entry else None)
-            print("DEBUG matches?:", candidate_matches(entry, candidate_title) if entry else None)
+                if debug:
+                    log.debug("candidate_title=%r matches=%s", candidate_title, matches)
 
-            # >>> DIT IS DE NIEUWE CHECK <<<
-            if entry and not candidate_matches(entry, candidate_title):
-                continue
-            
-            enc = item.find("enclosure")
-            if enc is not None and "url" in enc.attrib:
-                print(f"Match gevonden via zoekterm: {q}")
-                return enc.attrib["url"]
+                # >>> DIT IS DE NIEUWE CHECK <<<
+                if not matches:
+                    continue
+
+                enc_url = ENCLOSURE_URL(item)
+                if enc_url:
+                    print(f"Match gevonden via zoekterm: {q}")
+                    return enc_url
 
-    print("DEBUG ABOUT TO RETURN:", candidate_title)
     return None
 
 
@@ -247,11 +214,10 @@ def sab_addurl(nzb_url: str, nzbname: str) -> bool:
     if SAB_CATEGORY:
         params["cat"] = SAB_CATEGORY
 
-    url = f"{SAB_BASE_URL}/api?{urlencode(params)}"
-    r = requests.get(url, timeout=30)
+    r = _SESSION.get(f"{SAB_BASE_URL}/api", params=params, timeout=HTTP_TIMEOUT)
     r.raise_for_status()
 
-    data = r.json()
+    data = orjson.loads(r.content)
     return bool(data.get("status")) or bool(data.get("nzo_ids"))
     
 
@@ -260,18 +226,33 @@ def sab_addurl(nzb_url: str, nzbname: str) -> bool:
 # 4) MAIN (zelfde flow, maar met parsing-validatie)
 # ============================================================
 
+def _sab_add_match(entry_match: tuple[WishlistEntry, str]) -> Optional[bool]:
+    """sab_addurl voor (entry, nzb_url); None bij een fout (al gemeld)."""
+    entry, nzb_url = entry_match
+    try:
+        return sab_addurl(nzb_url, nzbname=entry.raw)
+    except Exception as e:
+        print(f"Fout bij '{entry.raw}': {e}")
+        return None
+
+
 def main() -> None:
     print("Wishlist container gestart")
 
-    while True:
+    signal.signal(signal.SIGTERM, lambda *_: _stop.set())
+    signal.signal(signal.SIGINT, lambda *_: _stop.set())
+
+    while not _stop.is_set():
         wishlist_lines = read_wishlist(WISHLIST_FILE)
 
         if not wishlist_lines:
             print("Wishlist leeg, wachten...")
-            time.sleep(INTERVAL_SECONDS)
+            _stop.wait(INTERVAL_SECONDS)
             continue
 
-        remaining: list[str] = []
+        # Regels in oorspronkelijke volgorde; gelukte adds vallen er later uit
+        kept: list[str] = []
+        matched: list[tuple[WishlistEntry, str]] = []
 
         for line in wishlist_lines:
             # Validatie van jouw nieuwe format
@@ -279,34 +260,42 @@ def main() -> None:
             
             if entry is None:
                 print(f"Ongeldige wishlist-regel (verwacht: auteurs - \"titel\"): {line}")
-                remaining.append(line)
+                kept.append(line)
                 continue
 
+            kept.append(entry.raw)
+
             try:
                 # Signature blijft: query is een string (de originele regel)
                 nzb_url = spotweb_search_first_nzb_url(entry.raw)
+            except Exception as e:
+                print(f"Fout bij '{entry.raw}': {e}")
+                continue
 
-                if not nzb_url:
-                    print(f"Niet gevonden: {entry.raw}")
-                    remaining.append(entry.raw)
-                    continue
+            if not nzb_url:
+                print(f"Niet gevonden: {entry.raw}")
+                continue
 
-                ok = sab_addurl(nzb_url, nzbname=entry.raw)
-                if ok:
-                    print(f"Toegevoegd: {entry.raw}")
-                else:
-                    print(f"Kon niet toevoegen: {entry.raw}")
-                    remaining.append(entry.raw)
+            matched.append((entry, nzb_url))
 
-            except Exception as e:
-                print(f"Fout bij '{entry.raw}': {e}")
-                remaining.append(entry.raw)
+        # Alle matches in één keer naar SAB, parallel over de keep-alive sessie
+        added: set[str] = set()
+        if matched:
+            with ThreadPoolExecutor(max_workers=min(len(matched), SAB_WORKERS)) as ex:
+                for (entry, _), ok in zip(matched, ex.map(_sab_add_match, matched)):
+                    if ok:
+                        print(f"Toegevoegd: {entry.raw}")
+                        added.add(entry.raw)
+                    elif ok is not None:
+                        print(f"Kon niet toevoegen: {entry.raw}")
+
+        remaining = [line for line in kept if line not in added]
 
         if remaining != wishlist_lines:
             write_wishlist(WISHLIST_FILE, remaining)
             print(f"Wishlist bijgewerkt ({len(remaining)} over)")
 
-        time.sleep(INTERVAL_SECONDS)
+        _stop.wait(INTERVAL_SECONDS)
 
 
 if __name__ == "__main__":
@@ -4,14 +4,19 @@ Worker proces voor Wishlist applicatie.
 Leest pending items uit database, zoekt in Spotweb, en voegt toe aan SABnzbd.
 """
 import os
+import queue
 import time
-import re
-import requests
-from urllib.parse import urlencode
-from lxml import etree
-from typing import List, Optional, Set
+import sched
+import signal
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from typing import Dict, FrozenSet, List, Optional, Tuple
 
 import database as db
+from matching import match, query_key, title_need, tokens
+from spotweb import ENCLOSURE_URL, HTTP_TIMEOUT, ITEM_TITLE, iter_spotweb_items, make_session
 import calibreweb
 
 # Config via environment
@@ -24,137 +29,267 @@ INTERVAL_SECONDS = int(os.environ.get("INTERVAL_SECONDS", "900"))  # 15 min
 IMPORT_CHECK_SECONDS = int(os.environ.get("IMPORT_CHECK_SECONDS", "120"))  # 2 min
 SPOTWEB_CAT = os.environ.get("SPOTWEB_CAT", "7020")  # Ebook
 SAB_CATEGORY = os.environ.get("SAB_CATEGORY", "books")
+VARIANT_WORKERS = int(os.environ.get("VARIANT_WORKERS", "4"))
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "3"))
+SPOTWEB_MAX_VARIANTS = int(os.environ.get("SPOTWEB_MAX_VARIANTS", "4"))
+SPOTWEB_CACHE_TTL = int(os.environ.get("SPOTWEB_CACHE_TTL", str(INTERVAL_SECONDS // 2)))
 
-# Stopwoorden voor matching
-STOPWORDS: Set[str] = {
-    "de", "het", "een", "van", "en", "der", "den", "te", "in", "op", "voor", "met", "aan", "bij", "uit",
-    "the", "a", "an", "of", "and", "to", "in", "on", "for", "with",
-}
+# Gezet bij SIGTERM/SIGINT: wachten tussen rondes wordt direct onderbroken
+_stop = threading.Event()
 
+# Logs gaan via een achtergrondthread in batches naar de database (één commit
+# per batch); zonder draaiende writer (bv. process_item in de web app) direct
+_LOG_QUEUE: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=10_000)
+LOG_BATCH_SIZE = 100
+_log_writer: Optional[threading.Thread] = None
 
-def _norm(s: str) -> str:
-    """Normaliseer string voor matching."""
-    s = (s or "").lower()
-    s = s.replace("–", "-").replace("—", "-")
-    s = re.sub(r"[^a-z0-9à-ÿ\s-]", " ", s, flags=re.UNICODE)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+# Wachttijd na 1, 2, 3, 4+ opeenvolgende keren "niet gevonden" (persistent in SQLite)
+MISS_BACKOFF_SECONDS = (0, 3600, 4 * 3600, 24 * 3600)
 
+# Gedeelde HTTP sessie (pool groot genoeg voor alle items x varianten die tegelijk lopen)
+_SESSION = make_session(max(8, WORKER_CONCURRENCY * VARIANT_WORKERS), "wishlist-worker/1.0")
 
-def _tokens(s: str) -> List[str]:
-    """Maak tokens van string (zonder stopwords)."""
-    parts = _norm(s).replace("-", " ").split()
-    return [w for w in parts if w and w not in STOPWORDS and len(w) > 1]
+# Resultaat per zoekopdracht: key -> (tijdstip, conditional headers, resultaat).
+# Binnen SPOTWEB_CACHE_TTL zonder request, daarna revalideren met ETag/Last-Modified
+_query_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+QUERY_CACHE_SIZE = 512
 
-
-def candidate_matches(author: str, title: str, candidate_title: str) -> bool:
-    """
-    Check of candidate title match is met author en title.
-
-    Logica:
-    - Minimaal 1 author token moet voorkomen in candidate
-    - Voor titel:
-        - Als titel >= 3 tokens: minimaal 2 titel tokens moeten matchen
-        - Anders: minimaal 1 titel token moet matchen
-    """
-    author_tokens = _tokens(author)
-    title_tokens = _tokens(title)
-    candidate_tokens = set(_tokens(candidate_title))
-
-    # Check author
-    author_ok = any(a in candidate_tokens for a in author_tokens)
-    if not author_ok:
-        return False
-
-    # Check title
-    if len(title_tokens) >= 3:
-        title_ok = sum(1 for t in title_tokens if t in candidate_tokens) >= 2
-    else:
-        title_ok = any(t in candidate_tokens for t in title_tokens)
-
-    return author_ok and title_ok
+# Volledig gelezen responses per (query, cat) -> (tijdstip, ((titel, url), ...)):
+# andere items met dezelfde variant (bv. zelfde auteur) matchen zonder request
+_candidates_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
 
 
 def search_variants(author: str, title: str) -> List[str]:
     """
     Maak zoek varianten voor betere Spotweb matches.
 
-    Returns: Lijst van zoekstrings om te proberen
+    Meest specifieke varianten eerst. Brede zoekopdrachten (alleen auteur,
+    alleen laatste titelwoord) worden niet gebruikt: ze halen de strenge
+    auteur+titel match zelden en kosten een request per item.
+
+    Returns: Lijst van zoekstrings om te proberen (max SPOTWEB_MAX_VARIANTS)
     """
     variants = []
 
     variants.append(f"{author} {title}")
-    variants.append(f"{title} {author}")
-    variants.append(title)
-    variants.append(author)
-
-    title_words = title.split()
-    if len(title_words) > 1:
-        variants.append(title_words[-1])
 
     author_words = author.split()
     if len(author_words) > 1:
         variants.append(f"{author_words[-1]} {title}")
 
-    seen = set()
-    unique_variants = []
+    variants.append(title)
+
+    # Uniek houden op genormaliseerde woorden (eerste variant wint)
+    unique: Dict[tuple, str] = {}
     for v in variants:
-        v_lower = v.lower().strip()
-        if v_lower and v_lower not in seen:
-            unique_variants.append(v)
-            seen.add(v_lower)
+        key = query_key(v)
+        if key:
+            unique.setdefault(key, v.strip())
+
+    return list(unique.values())[:SPOTWEB_MAX_VARIANTS]
+
+
+def _lru_put(cache: OrderedDict, key: tuple, value: tuple) -> None:
+    """Zet waarde in een query cache (LRU, begrensd op QUERY_CACHE_SIZE)."""
+    with _query_cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > QUERY_CACHE_SIZE:
+            cache.popitem(last=False)
 
-    return unique_variants
 
+def _store_query_result(key: tuple, validators: dict, nzb_url: Optional[str]) -> None:
+    """Bewaar resultaat van een zoekopdracht voor dit item."""
+    _lru_put(_query_cache, key, (time.monotonic(), validators, nzb_url))
 
-def spotweb_search(author: str, title: str) -> Optional[str]:
+
+def _spotweb_query(
+    query: str,
+    author_set: FrozenSet[str],
+    title_tokens: Tuple[str, ...],
+    need: int,
+    use_cache: bool = True
+) -> Tuple[Optional[str], bool]:
+    """
+    Eén Spotweb zoekopdracht; return (NZB URL van eerste match, None, of "" bij
+    een fout; True als Spotweb echt bevraagd is, False bij een cache hit).
+    use_cache=False slaat de query caches over (verse request, resultaat wordt wel bewaard).
+    """
+    params = {
+        "apikey": SPOTWEB_APIKEY,
+        "t": "search",
+        "extended": "1",
+        "q": query,
+        "cat": SPOTWEB_CAT,
+        "limit": "25",
+    }
+
+    key = (query, SPOTWEB_CAT, author_set, title_tokens)
+    cached = listed = None
+    if use_cache:
+        with _query_cache_lock:
+            cached = _query_cache.get(key)
+            listed = _candidates_cache.get((query, SPOTWEB_CAT))
+
+    if cached and time.monotonic() - cached[0] < SPOTWEB_CACHE_TTL:
+        return cached[2], False
+
+    # Zelfde variant al volledig gelezen voor een ander item: alleen matchen
+    if listed and time.monotonic() - listed[0] < SPOTWEB_CACHE_TTL:
+        nzb_url = next(
+            (url for t, url in listed[1] if url and match(author_set, title_tokens, need, t)),
+            None
+        )
+        _store_query_result(key, cached[1] if cached else {}, nzb_url)
+        return nzb_url, False
+
+    try:
+        # Conditional GET: bij 304 is het vorige resultaat nog geldig.
+        # Parsen loopt gelijk op met ontvangen; stopt bij de eerste match
+        headers = cached[1] if cached else None
+        with _SESSION.get(f"{SPOTWEB_BASE_URL}/api", params=params, headers=headers, timeout=HTTP_TIMEOUT, stream=True) as r:
+            if r.status_code == 304 and cached:
+                _store_query_result(key, cached[1], cached[2])
+                return cached[2], True
+            r.raise_for_status()
+
+            nzb_url = None
+            candidates = []
+            for item in iter_spotweb_items(r):
+                candidate_title = ITEM_TITLE(item)
+                if not candidate_title:
+                    continue
+
+                enc_url = ENCLOSURE_URL(item)
+                candidates.append((candidate_title, enc_url))
+
+                if enc_url and match(author_set, title_tokens, need, candidate_title):
+                    nzb_url = enc_url
+                    break
+            else:
+                _lru_put(_candidates_cache, (query, SPOTWEB_CAT), (time.monotonic(), tuple(candidates)))
+
+            validators = {}
+            if r.headers.get("ETag"):
+                validators["If-None-Match"] = r.headers["ETag"]
+            if r.headers.get("Last-Modified"):
+                validators["If-Modified-Since"] = r.headers["Last-Modified"]
+
+        _store_query_result(key, validators, nzb_url)
+        return nzb_url, True
+
+    except Exception:
+        # Lege string: zoekopdracht mislukt, telt niet als "niet gevonden"
+        return "", True
+
+
+def in_miss_backoff(item) -> bool:
+    """True als het item recent herhaald niet gevonden is en nog even overgeslagen wordt."""
+    cached = db.get_spotweb_cache(item['author'], item['title'])
+    if not cached or not cached['misses']:
+        return False
+
+    backoff = MISS_BACKOFF_SECONDS[min(cached['misses'], len(MISS_BACKOFF_SECONDS)) - 1]
+    return time.time() - cached['last_checked'] < backoff
+
+
+def spotweb_search(author: str, title: str, use_cache: bool = True) -> Optional[str]:
     """
     Zoek in Spotweb naar item.
 
+    Alle zoekvarianten worden parallel opgevraagd; de volgorde van de
+    varianten bepaalt nog steeds welke match wint. Met use_cache=False
+    (handmatige zoekactie) gaat elke variant opnieuw naar Spotweb.
+
     Returns: NZB URL als gevonden, anders None
     """
-    parser = etree.XMLParser(recover=True)
+    # Tokens van het wishlist item één keer berekenen, niet per kandidaat
+    author_set = frozenset(tokens(author))
+    title_tokens = tokens(title)
+    need = title_need(title_tokens)
 
-    for query in search_variants(author, title):
-        params = {
-            "apikey": SPOTWEB_APIKEY,
-            "t": "search",
-            "extended": "1",
-            "q": query,
-            "cat": SPOTWEB_CAT,
-            "limit": "25",
-        }
+    variants = search_variants(author, title)
+    if not variants:
+        return None
 
-        url = f"{SPOTWEB_BASE_URL}/api?{urlencode(params)}"
+    nzb_url = None
+    failed = False
+    fetched = False
 
+    ex = ThreadPoolExecutor(max_workers=min(len(variants), VARIANT_WORKERS))
+    try:
+        futures = [
+            ex.submit(_spotweb_query, q, author_set, title_tokens, need, use_cache)
+            for q in variants
+        ]
+        for future in futures:
+            result, from_network = future.result()
+            if result:
+                nzb_url = result
+                break
+            failed = failed or result == ""
+            fetched = fetched or from_network
+    finally:
+        # Niet wachten op overbodige varianten
+        ex.shutdown(wait=False, cancel_futures=True)
+
+    # Netwerkfouten niet als miss tellen (anders backoff bij Spotweb storing),
+    # en een miss uit de query caches ook niet: Spotweb is dan niet bevraagd
+    if nzb_url or (fetched and not failed):
+        db.set_spotweb_cache(author, title, nzb_url)
+
+    return nzb_url
+
+
+def _log(item_id: Optional[int], level: str, message: str) -> None:
+    """db.add_log via de achtergrondqueue; synchroon als die vol is of niet draait."""
+    if _log_writer is not None:
         try:
-            r = requests.get(url, timeout=30)
-            r.raise_for_status()
-
-            root = etree.fromstring(r.content, parser)
-            channel = root.find("channel")
-
-            if channel is None:
-                continue
-
-            results = channel.findall("item")
+            _LOG_QUEUE.put_nowait((item_id, level, message))
+            return
+        except queue.Full:
+            pass
 
-            for item in results:
-                title_el = item.find("title")
-                if title_el is None:
-                    continue
+    db.add_log(item_id, level, message)
 
-                candidate_title = title_el.text or ""
 
-                if candidate_matches(author, title, candidate_title):
-                    enc = item.find("enclosure")
-                    if enc is not None and "url" in enc.attrib:
-                        return enc.attrib["url"]
+def _set_status(
+    item_id: int,
+    status: str,
+    nzb_url: Optional[str] = None,
+    error_message: Optional[str] = None
+) -> None:
+    """
+    db.update_wishlist_status, met de status log via _log: zo blijft die in
+    volgorde met de andere (gequeuede) logs van het item.
+    """
+    db.update_wishlist_status(item_id, status, nzb_url, error_message, log=False)
+    _log(item_id, "info", db.status_log_message(status, error_message))
 
-        except Exception:
-            continue
 
-    return None
+def _write_logs() -> None:
+    """Schrijf queued logs in batches weg, tot de None sentinel."""
+    while True:
+        batch = []
+        entry = _LOG_QUEUE.get()
+        while entry is not None:
+            batch.append(entry)
+            if len(batch) >= LOG_BATCH_SIZE:
+                break
+            try:
+                entry = _LOG_QUEUE.get_nowait()
+            except queue.Empty:
+                break
+
+        if batch:
+            try:
+                db.add_logs(batch)
+            except Exception as e:
+                print(f"Fout bij wegschrijven logs: {e}")
+
+        if entry is None:
+            return
 
 
 def sab_addurl(nzb_url: str, nzbname: str) -> bool:
@@ -174,43 +309,42 @@ def sab_addurl(nzb_url: str, nzbname: str) -> bool:
     if SAB_CATEGORY:
         params["cat"] = SAB_CATEGORY
 
-    url = f"{SAB_BASE_URL}/api?{urlencode(params)}"
-
     try:
-        r = requests.get(url, timeout=30)
+        r = _SESSION.get(f"{SAB_BASE_URL}/api", params=params, timeout=HTTP_TIMEOUT)
         r.raise_for_status()
 
-        data = r.json()
+        data = orjson.loads(r.content)
         success = bool(data.get("status")) or bool(data.get("nzo_ids"))
 
         if not success:
-            db.add_log(None, "error", f"SABnzbd weigerde NZB: {data.get('error', data)}")
+            _log(None, "error", f"SABnzbd weigerde NZB: {data.get('error', data)}")
 
         return success
 
     except Exception as e:
-        db.add_log(None, "error", f"SABnzbd fout: {e}")
+        _log(None, "error", f"SABnzbd fout: {e}")
         return False
 
 
-def process_item(item: dict) -> None:
+def process_item(item, use_cache: bool = True) -> None:
     """
     Verwerk een enkel wishlist item.
 
     Zoekt in Spotweb en voegt toe aan SABnzbd indien gevonden.
+    use_cache=False omzeilt de Spotweb query caches (handmatig "Zoek nu").
     """
     item_id = item['id']
     author = item['author']
     title = item['title']
 
-    db.add_log(item_id, "info", "Zoeken gestart")
-    db.update_wishlist_status(item_id, "searching")
+    _log(item_id, "info", "Zoeken gestart")
+    _set_status(item_id, "searching")
 
     try:
-        nzb_url = spotweb_search(author, title)
+        nzb_url = spotweb_search(author, title, use_cache)
 
         if not nzb_url:
-            db.update_wishlist_status(
+            _set_status(
                 item_id,
                 "pending",
                 error_message="Niet gevonden in Spotweb"
@@ -221,25 +355,25 @@ def process_item(item: dict) -> None:
         success = sab_addurl(nzb_url, nzbname)
 
         if success:
-            shelf_name = item.get('shelf_name')
+            shelf_name = item['shelf_name']
 
             if shelf_name and calibreweb.is_configured():
-                db.update_wishlist_status(
+                _set_status(
                     item_id,
                     "importing",
                     nzb_url=nzb_url
                 )
-                db.add_log(item_id, "info", f"✓ SABnzbd OK, wachten op Calibre import → {shelf_name}")
+                _log(item_id, "info", f"✓ SABnzbd OK, wachten op Calibre import → {shelf_name}")
             else:
-                db.update_wishlist_status(
+                _set_status(
                     item_id,
                     "found",
                     nzb_url=nzb_url
                 )
-                db.add_log(item_id, "info", "✓ Toegevoegd aan SABnzbd")
+                _log(item_id, "info", "✓ Toegevoegd aan SABnzbd")
 
         else:
-            db.update_wishlist_status(
+            _set_status(
                 item_id,
                 "failed",
                 nzb_url=nzb_url,
@@ -247,12 +381,12 @@ def process_item(item: dict) -> None:
             )
 
     except Exception as e:
-        db.update_wishlist_status(
+        _set_status(
             item_id,
             "failed",
             error_message=str(e)
         )
-        db.add_log(item_id, "error", f"Fout: {e}")
+        _log(item_id, "error", f"Fout: {e}")
 
 
 def check_importing_items() -> None:
@@ -267,15 +401,24 @@ def check_importing_items() -> None:
     if not importing:
         return
 
+    # Alle doelplanken in één keer opzoeken
+    try:
+        shelf_ids = calibreweb.resolve_shelf_ids(
+            item['shelf_name'] for item in importing if item['shelf_name']
+        )
+    except Exception as e:
+        _log(None, "error", f"Calibre-Web planken ophalen mislukt: {e}")
+        return
+
     for item in importing:
         item_id = item['id']
         author = item['author']
         title = item['title']
-        shelf_name = item.get('shelf_name')
+        shelf_name = item['shelf_name']
 
         if not shelf_name:
-            db.update_wishlist_status(item_id, "found")
-            db.add_log(item_id, "info", "Geen boekenplank, status → gevonden")
+            _set_status(item_id, "found")
+            _log(item_id, "info", "Geen boekenplank, status → gevonden")
             continue
 
         try:
@@ -284,53 +427,91 @@ def check_importing_items() -> None:
             if not book_id:
                 continue
 
-            success = calibreweb.add_book_to_shelf(shelf_name, book_id)
+            shelf_id = shelf_ids.get(shelf_name)
+            if shelf_id is None:
+                _log(item_id, "warning", f"Boek gevonden (book_id={book_id}) maar plank '{shelf_name}' niet gevonden")
+                continue
+
+            success = calibreweb.add_book_to_shelf_by_id(shelf_id, book_id)
 
             if success:
-                db.update_wishlist_status(item_id, "shelved")
-                db.add_log(item_id, "info", f"✓ Op boekenplank gezet: {shelf_name} (book_id={book_id})")
+                _set_status(item_id, "shelved")
+                _log(item_id, "info", f"✓ Op boekenplank gezet: {shelf_name} (book_id={book_id})")
             else:
-                db.add_log(item_id, "warning", f"Boek gevonden (book_id={book_id}) maar plank toevoegen mislukt")
+                _log(item_id, "warning", f"Boek gevonden (book_id={book_id}) maar plank toevoegen mislukt")
 
         except Exception as e:
-            db.add_log(item_id, "error", f"Calibre-Web fout: {e}")
+            _log(item_id, "error", f"Calibre-Web fout: {e}")
 
-        time.sleep(2)
+        if _stop.wait(2):
+            return
 
 
-def worker_loop() -> None:
-    """Main worker loop."""
-    print("Worker gestart")
+def search_pending_items() -> None:
+    """Zoek alle pending items, behalve items die in miss-backoff zitten."""
+    pending_items = [
+        item for item in db.get_wishlist_items(status='pending')
+        if not in_miss_backoff(item)
+    ]
 
-    last_search_time = 0
+    # Items parallel verwerken (netwerk-bound); de pool begrenst de belasting
+    if pending_items:
+        with ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY) as ex:
+            list(ex.map(process_item, pending_items))
 
-    while True:
-        try:
-            now = time.time()
 
-            if now - last_search_time >= INTERVAL_SECONDS:
-                pending_items = db.get_wishlist_items(status='pending')
+def _run_periodic(scheduler: sched.scheduler, interval: int, task) -> None:
+    """Voer task uit en plan de volgende run interval seconden na afloop."""
+    try:
+        task()
+    except Exception as e:
+        _log(None, "error", f"Worker fout: {e}")
+
+    if not _stop.is_set():
+        scheduler.enter(interval, 1, _run_periodic, (scheduler, interval, task))
+
 
-                if pending_items:
-                    for item in pending_items:
-                        process_item(item)
-                        time.sleep(2)
+def worker_loop() -> None:
+    """
+    Main worker loop.
 
-                last_search_time = time.time()
+    Zoeken (INTERVAL_SECONDS) en import checks (IMPORT_CHECK_SECONDS) zijn
+    losse periodieke taken, elk met een eigen ritme.
+    """
+    print("Worker gestart")
 
-            check_importing_items()
+    def wait(delay: float) -> None:
+        # Bij stop: resterende taken annuleren zodat run() direct terugkeert
+        if _stop.wait(delay):
+            for event in scheduler.queue:
+                scheduler.cancel(event)
 
-        except Exception as e:
-            db.add_log(None, "error", f"Worker fout: {e}")
+    scheduler = sched.scheduler(time.monotonic, wait)
+    scheduler.enter(0, 1, _run_periodic, (scheduler, INTERVAL_SECONDS, search_pending_items))
+    scheduler.enter(0, 2, _run_periodic, (scheduler, IMPORT_CHECK_SECONDS, check_importing_items))
+    scheduler.run()
 
-        time.sleep(IMPORT_CHECK_SECONDS)
+    print("Worker gestopt")
 
 
 def main():
     """Main entry point."""
+    global _log_writer
+
+    signal.signal(signal.SIGTERM, lambda *_: _stop.set())
+    signal.signal(signal.SIGINT, lambda *_: _stop.set())
+
     db.init_db()
+
+    _log_writer = threading.Thread(target=_write_logs, daemon=True)
+    _log_writer.start()
+
     worker_loop()
 
+    # Resterende logs wegschrijven
+    _LOG_QUEUE.put(None)
+    _log_writer.join(timeout=10)
+
 
 if __name__ == "__main__":
     main()